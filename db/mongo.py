@@ -1,8 +1,10 @@
+from pymongo import monitoring
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import os
-from pymongo.errors import ConnectionFailure
+import threading
+import time
 import urllib.parse
 
 # Load environment variables
@@ -10,27 +12,136 @@ load_dotenv()
 
 username = os.getenv("MONGO_DB_USERNAME")
 password = os.getenv("MONGO_DB_PASSWORD")
-host = os.getenv("MONGO_DB_HOST")
-port = os.getenv("MONGO_DB_PORT")
+host = os.getenv("MONGO_DB_HOST", "localhost")
+port = os.getenv("MONGO_DB_PORT", "27017")
+db_name = os.getenv("MONGO_DB_NAME", "vizlydb")
 
-# Encode password in case it contains special characters like * or @
-encoded_password = urllib.parse.quote_plus(password)
+# Pool sizing and timeouts. maxConnecting keeps a freshly started worker from
+# opening its whole pool at once when many workers come up together.
+client_options = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxConnecting": int(os.getenv("MONGO_MAX_CONNECTING", "2")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000")),
+    # zstd/snappy need the zstandard/python-snappy packages; zlib is always available
+    "compressors": os.getenv("MONGO_COMPRESSORS", "zlib"),
+}
 
-uri = f"mongodb://{username}:{encoded_password}@{host}:{port}"
 
-try:
-    client = MongoClient(uri, server_api=ServerApi("1"))
-    
-    client.admin.command("ping")
-    print("Successfully connected to MongoDB!")
-    
-    db = client["vizlydb"]
-    print("📘 Database selected:", db.name)
+def _build_uri() -> str:
+    if not username:
+        return f"mongodb://{host}:{port}"
+    # Encode password in case it contains special characters like * or @
+    encoded_password = urllib.parse.quote_plus(password or "")
+    return f"mongodb://{username}:{encoded_password}@{host}:{port}"
 
-except ConnectionFailure as e:
-    print("Could not connect to MongoDB:", e)
-except Exception as e:
-    print("An error occurred:", e)
 
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so readiness checks can report pool health"""
 
-db = client["vizlydb"]
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures", 1)
+
+    def pool_cleared(self, event):
+        self._add("pool_clears", 1)
+
+    # Remaining events carry nothing we report
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+                "max_pool_size": client_options["maxPoolSize"],
+            }
+
+
+pool_stats = PoolStats()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """Returns the shared client, creating it on first use. Creating it does not touch the network."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    _build_uri(),
+                    server_api=ServerApi("1"),
+                    event_listeners=[pool_stats],
+                    **client_options,
+                )
+    return _client
+
+
+def get_db():
+    return get_client()[db_name]
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def ping() -> float:
+    """Round-trips a ping to the server and returns the latency in ms. Raises on failure."""
+    start = time.perf_counter()
+    get_client().admin.command("ping")
+    return (time.perf_counter() - start) * 1000
+
+
+class LazyCollection:
+    """
+    Stands in for a pymongo Collection at import time and resolves it on first
+    use, so importing models/routers never needs a reachable database.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+def collection(name: str) -> LazyCollection:
+    return LazyCollection(name)
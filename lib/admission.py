@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from starlette.responses import JSONResponse
+
+# Admission control for heavy endpoints. Every HTTP request is put in a class
+# (interactive reads, aggregates, bulk uploads/dumps). Each class has its own
+# concurrency limit and bounded queue, and all classes share a total budget.
+# When a slot frees up, waiters are admitted in priority order, so cheap
+# dashboard reads are never stuck behind uploads. Saturation is answered with
+# 429 (queue full) or 503 (queued past the class deadline), with Retry-After.
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+@dataclass
+class RequestClass:
+    name: str
+    priority: int  # lower is admitted first
+    limit: int
+    max_queue: int
+    queue_timeout: float  # seconds a request may wait before it is shed with 503
+    active: int = 0
+    queued: int = 0
+    admitted: int = 0
+    rejected_queue_full: int = 0
+    rejected_deadline: int = 0
+    avg_service_s: float = 0.0
+
+    def record_service_time(self, seconds: float):
+        # Exponentially weighted, so Retry-After follows the current load
+        self.avg_service_s = seconds if not self.avg_service_s else 0.8 * self.avg_service_s + 0.2 * seconds
+
+
+def _request_class(name: str, priority: int, limit: int, max_queue: int, queue_timeout: float) -> RequestClass:
+    prefix = f"ADMISSION_{name.upper()}"
+    return RequestClass(
+        name=name,
+        priority=priority,
+        limit=_env_int(f"{prefix}_LIMIT", limit),
+        max_queue=_env_int(f"{prefix}_QUEUE", max_queue),
+        queue_timeout=_env_float(f"{prefix}_TIMEOUT_S", queue_timeout),
+    )
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    request_class: RequestClass = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, total_limit: int, classes: list):
+        self.total_limit = total_limit
+        self.active = 0
+        self.classes = {c.name: c for c in classes}
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _has_capacity(self, request_class: RequestClass) -> bool:
+        return self.active < self.total_limit and request_class.active < request_class.limit
+
+    def _grant(self, request_class: RequestClass):
+        self.active += 1
+        request_class.active += 1
+        request_class.admitted += 1
+
+    def _retry_after(self, request_class: RequestClass) -> int:
+        # Rough time for the current queue to drain through the class's slots
+        backlog = (request_class.queued + 1) / max(request_class.limit, 1)
+        return max(1, math.ceil(backlog * (request_class.avg_service_s or 1.0)))
+
+    async def acquire(self, name: str):
+        request_class = self.classes[name]
+
+        # Every release dispatches waiters first, so a free slot here isn't owed to anyone queued
+        if self._has_capacity(request_class):
+            self._grant(request_class)
+            return
+
+        if request_class.queued >= request_class.max_queue:
+            request_class.rejected_queue_full += 1
+            raise AdmissionRejected(429, f"Too many queued {name} requests", self._retry_after(request_class))
+
+        waiter = _Waiter(request_class.priority, next(self._seq), request_class, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        request_class.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=request_class.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # Granted just as the deadline hit; keep the slot
+                return
+            waiter.future.cancel()
+            request_class.rejected_deadline += 1
+            raise AdmissionRejected(503, f"Server busy; {name} request waited too long", self._retry_after(request_class))
+        except asyncio.CancelledError:
+            # Client went away while queued; hand back a slot that was granted meanwhile
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._free(request_class)
+            else:
+                waiter.future.cancel()
+            raise
+        finally:
+            request_class.queued -= 1
+
+    def release(self, name: str, service_seconds: float):
+        request_class = self.classes[name]
+        request_class.record_service_time(service_seconds)
+        self._free(request_class)
+
+    def _free(self, request_class: RequestClass):
+        self.active -= 1
+        request_class.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admits waiters in priority order while capacity remains"""
+        skipped = []
+        while self._waiters and self.active < self.total_limit:
+            waiter = heapq.heappop(self._waiters)
+            if waiter.future.done():
+                continue  # timed out or cancelled
+            if not self._has_capacity(waiter.request_class):
+                skipped.append(waiter)  # its class is full, let lower priorities through
+                continue
+            self._grant(waiter.request_class)
+            waiter.future.set_result(True)
+        for waiter in skipped:
+            heapq.heappush(self._waiters, waiter)
+
+    def snapshot(self) -> dict:
+        return {
+            "total_limit": self.total_limit,
+            "active": self.active,
+            "classes": {
+                c.name: {
+                    "priority": c.priority,
+                    "limit": c.limit,
+                    "active": c.active,
+                    "queued": c.queued,
+                    "max_queue": c.max_queue,
+                    "queue_timeout_s": c.queue_timeout,
+                    "admitted": c.admitted,
+                    "rejected_queue_full": c.rejected_queue_full,
+                    "rejected_deadline": c.rejected_deadline,
+                    "avg_service_ms": round(c.avg_service_s * 1000, 2),
+                }
+                for c in self.classes.values()
+            },
+        }
+
+
+controller = AdmissionController(
+    total_limit=_env_int("ADMISSION_TOTAL_LIMIT", 32),
+    classes=[
+        _request_class("interactive", priority=0, limit=32, max_queue=200, queue_timeout=5),
+        _request_class("aggregate", priority=1, limit=8, max_queue=50, queue_timeout=15),
+        _request_class("bulk", priority=2, limit=2, max_queue=10, queue_timeout=30),
+    ],
+)
+
+# (method, path pattern, class); first match wins, everything else is interactive
+ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/api/(dataset|schemaless|parquet)/upload$"), "bulk"),
+    ("GET", re.compile(r"^/api/dataset/all/(data|headers)$"), "bulk"),
+    ("GET", re.compile(r"^/api/(dataset|schemaless)/[^/]+/data$"), "bulk"),
+    ("POST", re.compile(r"^/api/parquet/chart-data$"), "bulk"),
+    ("GET", re.compile(r"^/api/(dataset|schemaless|parquet)/[^/]+/export$"), "bulk"),
+    ("POST", re.compile(r"^/api/(chart|schemaless|parquet)/aggregate/export$"), "bulk"),
+    ("POST", re.compile(r"^/api/(chart|schemaless|parquet)/aggregate$"), "aggregate"),
+    ("GET", re.compile(r"^/api/chart/year-range$"), "aggregate"),
+    ("GET", re.compile(r"^/api/(dataset|schemaless)/[^/]+/headers$"), "aggregate"),  # reads every row of the upload
+]
+EXEMPT_PATHS = re.compile(r"^/api/health/")
+
+
+def classify(method: str, path: str):
+    if EXEMPT_PATHS.match(path) or method == "OPTIONS":
+        return None
+    for route_method, pattern, name in ROUTE_CLASSES:
+        if method == route_method and pattern.match(path):
+            return name
+    return "interactive"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware, so a slot is held until the response body has been fully
+    sent (streamed exports and dumps included), not just until headers are ready.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        name = classify(scope["method"], scope["path"])
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await controller.acquire(name)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=e.status_code,
+                content={"detail": e.detail},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(name, time.perf_counter() - start)
@@ -0,0 +1,394 @@
+import math
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import pandas as pd
+from lib.slow_query import run_aggregate
+from schemas.aggregate import Measure
+
+# Shared $group pipeline building for /chart/aggregate and /schemaless/aggregate.
+# Measures are grouped under internal names (m0, m1, ...) so arbitrary column
+# names never end up as Mongo field names, and mapped back when shaping.
+
+AGG_FUNCS = {"sum": "$sum", "avg": "$avg", "count": "$sum", "min": "$min", "max": "$max"}
+
+# Every ingested row gets a uniform random key in [0, 1) under SAMPLE_FIELD, so a
+# Bernoulli sample at rate r is an indexed range read on (upload_id, _sample).
+SAMPLE_FIELD = "_sample"
+CONFIDENCE = 0.95
+Z_SCORE = 1.96
+
+TIME_GRAINS = ("hour", "day", "week", "month", "quarter", "year")
+# pandas frequencies producing the same bucket starts as $dateTrunc (weeks start on Sunday)
+_GRAIN_FREQ = {"hour": "h", "day": "D", "week": "W-SUN", "month": "MS", "quarter": "QS", "year": "YS"}
+# Upper bound on buckets produced by gap filling, so a wide range can't explode the response
+MAX_FILLED_BUCKETS = 10000
+
+ORDER_BY = ("key", "value")
+# x value of the group the tail is folded into when top_n is set
+OTHER_LABEL = "(other)"
+
+
+def resolve_measures(y_axis: Optional[str], agg_func: str, measures: Optional[List[Measure]]) -> List[Measure]:
+    """Returns the requested measures, falling back to the single y_axis/agg_func pair. Raises ValueError."""
+    if not measures:
+        if not y_axis:
+            raise ValueError("Either y_axis or measures must be provided")
+        measures = [Measure(y_axis=y_axis, agg_func=agg_func)]
+
+    for measure in measures:
+        if measure.agg_func not in AGG_FUNCS:
+            raise ValueError(f"Invalid agg_func. Choose from {list(AGG_FUNCS.keys())}")
+        if measure.agg_func != "count" and not measure.y_axis:
+            raise ValueError(f"y_axis is required for agg_func '{measure.agg_func}'")
+
+    keys = [measure_key(m) for m in measures]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Duplicate measures; set a distinct alias for each")
+    return measures
+
+
+def measure_key(measure: Measure) -> str:
+    if measure.alias:
+        return measure.alias
+    if measure.agg_func == "count" and not measure.y_axis:
+        return "count"
+    return f"{measure.y_axis}_{measure.agg_func}"
+
+
+def measure_accumulator(measure: Measure) -> dict:
+    if measure.agg_func == "count":
+        return {"$sum": 1}
+    return {AGG_FUNCS[measure.agg_func]: f"${measure.y_axis}"}
+
+
+def validate_time_grain(time_grain: Optional[str], timezone: Optional[str] = None):
+    if time_grain and time_grain not in TIME_GRAINS:
+        raise ValueError(f"Invalid time_grain. Choose from {list(TIME_GRAINS)}")
+    if timezone:
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone '{timezone}'")
+
+
+def x_expression(x_axis: str, time_grain: Optional[str] = None, timezone: Optional[str] = None):
+    """Group key for the x axis, truncated to time_grain when bucketing dates"""
+    if not time_grain:
+        return f"${x_axis}"
+    # Stored dates may be BSON dates or ISO strings; unparsable values land in a null bucket
+    as_date = {"$convert": {"input": f"${x_axis}", "to": "date", "onError": None, "onNull": None}}
+    trunc = {"date": as_date, "unit": time_grain}
+    if timezone:
+        trunc["timezone"] = timezone
+    return {"$dateTrunc": trunc}
+
+
+def build_group_stage(x_axis: str, measures: List[Measure], series_by: Optional[str] = None,
+                      with_moments: bool = False, time_grain: Optional[str] = None,
+                      timezone: Optional[str] = None, with_totals: bool = False) -> dict:
+    x = x_expression(x_axis, time_grain, timezone)
+    group_id = {"x": x, "s": f"${series_by}"} if series_by else x
+    group = {"_id": group_id}
+    for i, measure in enumerate(measures):
+        group[f"m{i}"] = measure_accumulator(measure)
+        field = f"${measure.y_axis}"
+        if with_moments and measure.agg_func in ("sum", "avg"):
+            # Sum of squares (sum) and spread/count of numeric values (avg) for error bounds
+            # $multiply rejects strings, which $sum/$avg skip, so square numbers only
+            group[f"q{i}"] = {"$sum": {"$cond": [{"$isNumber": field}, {"$multiply": [field, field]}, 0]}}
+            group[f"sd{i}"] = {"$stdDevSamp": field}
+            group[f"c{i}"] = {"$sum": {"$cond": [{"$isNumber": field}, 1, 0]}}
+        if with_totals and measure.agg_func == "avg":
+            # Averages can't be merged across groups; their total and count can
+            group[f"t{i}"] = {"$sum": field}
+            group[f"c{i}"] = {"$sum": {"$cond": [{"$isNumber": field}, 1, 0]}}
+    if with_moments:
+        group["n"] = {"$sum": 1}
+    return {"$group": group}
+
+
+def validate_ranking(top_n: Optional[int], order_by: Optional[str], order: Optional[str],
+                     time_grain: Optional[str] = None, approximate: bool = False, fill_gaps: bool = False):
+    if top_n is not None:
+        if top_n < 1:
+            raise ValueError("top_n must be at least 1")
+        if time_grain:
+            raise ValueError("top_n can't be combined with time_grain")
+        if approximate:
+            raise ValueError("top_n can't be combined with approximate")
+    if order_by and order_by not in ORDER_BY:
+        raise ValueError(f"Invalid order_by. Choose from {list(ORDER_BY)}")
+    if order and order not in ("asc", "desc"):
+        raise ValueError("Invalid order. Choose from ['asc', 'desc']")
+    if order_by == "value" and time_grain and fill_gaps:
+        # Filled buckets have no value to rank; gap-filled series are ordered by time
+        raise ValueError("order_by 'value' can't be combined with fill_gaps")
+
+
+def _merge_accumulators(measures: List[Measure]) -> dict:
+    """$group fields combining already grouped measures (avg via its total/count)"""
+    fields = {}
+    for i, measure in enumerate(measures):
+        if measure.agg_func == "avg":
+            fields[f"t{i}"] = {"$sum": f"$t{i}"}
+            fields[f"c{i}"] = {"$sum": f"$c{i}"}
+        else:
+            # count merges as a sum of counts, which AGG_FUNCS already maps it to
+            fields[f"m{i}"] = {AGG_FUNCS[measure.agg_func]: f"$m{i}"}
+    return fields
+
+
+def _merged_averages(measures: List[Measure]) -> list:
+    averages = {
+        f"m{i}": {"$cond": [{"$gt": [f"$c{i}", 0]}, {"$divide": [f"$t{i}", f"$c{i}"]}, None]}
+        for i, measure in enumerate(measures) if measure.agg_func == "avg"
+    }
+    return [{"$set": averages}] if averages else []
+
+
+def _needs_totals(measures: List[Measure], series_by: Optional[str], top_n: Optional[int],
+                  order_by: Optional[str]) -> bool:
+    ranked_across_series = bool(series_by) and (order_by or ("value" if top_n else "key")) == "value"
+    return any(m.agg_func == "avg" for m in measures) and (bool(top_n) or ranked_across_series)
+
+
+def build_order_stages(measures: List[Measure], series_by: Optional[str] = None, top_n: Optional[int] = None,
+                       order_by: Optional[str] = None, order: Optional[str] = None) -> list:
+    """
+    Stages after the $group that order the groups by key or by the first measure and,
+    with top_n, keep the first top_n x values and fold the rest into one OTHER_LABEL
+    group. With series_by, x values are ranked by their first measure over all series.
+    Defaults: by key ascending, or by value descending when top_n is set.
+    """
+    order_by = order_by or ("value" if top_n else "key")
+    direction = 1 if (order or ("desc" if order_by == "value" else "asc")) == "asc" else -1
+
+    if not top_n and (order_by == "key" or not series_by):
+        if order_by == "value":
+            return [{"$sort": {"m0": direction, "_id": 1}}]
+        return [{"$sort": {"_id.x": direction, "_id.s": 1} if series_by else {"_id": direction}}]
+
+    if series_by:
+        # One document per x carrying its series rows, ranked on the merged first measure
+        stages = [
+            {"$sort": {"_id.s": 1}},
+            {"$group": {"_id": "$_id.x", **_merge_accumulators(measures[:1]), "rows": {"$push": "$$ROOT"}}},
+            *_merged_averages(measures[:1]),
+            {"$sort": {"m0": direction, "_id": 1} if order_by == "value" else {"_id": direction}},
+        ]
+        unwind_rows = [{"$unwind": "$rows"}, {"$replaceRoot": {"newRoot": "$rows"}}]
+        if not top_n:
+            return stages + unwind_rows
+        top = [{"$limit": top_n}, *unwind_rows]
+        other = [
+            {"$skip": top_n},
+            *unwind_rows,
+            {"$group": {"_id": {"x": OTHER_LABEL, "s": "$_id.s"}, **_merge_accumulators(measures)}},
+            *_merged_averages(measures),
+            {"$sort": {"_id.s": 1}},
+        ]
+    else:
+        stages = [{"$sort": {"m0": direction, "_id": 1} if order_by == "value" else {"_id": direction}}]
+        top = [{"$limit": top_n}]
+        other = [
+            {"$skip": top_n},
+            {"$group": {"_id": OTHER_LABEL, **_merge_accumulators(measures)}},
+            *_merged_averages(measures),
+        ]
+
+    # The tail is empty when there are at most top_n groups, and then adds nothing
+    return stages + [
+        {"$facet": {"top": top, "other": other}},
+        {"$project": {"groups": {"$concatArrays": ["$top", "$other"]}}},
+        {"$unwind": "$groups"},
+        {"$replaceRoot": {"newRoot": "$groups"}},
+    ]
+
+
+def build_aggregate_pipeline(match_stage: dict, x_axis: str, measures: List[Measure],
+                             series_by: Optional[str] = None, time_grain: Optional[str] = None,
+                             timezone: Optional[str] = None, top_n: Optional[int] = None,
+                             order_by: Optional[str] = None, order: Optional[str] = None) -> list:
+    """Builds a single-pass pipeline computing every measure per x (and series) group"""
+    with_totals = _needs_totals(measures, series_by, top_n, order_by)
+    return [
+        {"$match": match_stage},
+        build_group_stage(x_axis, measures, series_by, time_grain=time_grain, timezone=timezone,
+                          with_totals=with_totals),
+        *build_order_stages(measures, series_by, top_n, order_by, order),
+    ]
+
+
+def build_sample_pipeline(match_stage: dict, x_axis: str, measures: List[Measure],
+                          series_by: Optional[str], rate: float, sample_size: int,
+                          has_sample_field: bool = True, time_grain: Optional[str] = None,
+                          timezone: Optional[str] = None, order_by: Optional[str] = None,
+                          order: Optional[str] = None) -> list:
+    """
+    Builds the pipeline for approximate mode. Uploads ingested with SAMPLE_FIELD are
+    sampled by an indexed range on it; older uploads fall back to $sample.
+    """
+    if rate >= 1:
+        sampling = []
+    elif has_sample_field:
+        match_stage = {"$and": [match_stage, {SAMPLE_FIELD: {"$lt": rate}}]}
+        sampling = []
+    else:
+        sampling = [{"$sample": {"size": sample_size}}]
+
+    with_totals = _needs_totals(measures, series_by, None, order_by)
+    return [
+        {"$match": match_stage},
+        *sampling,
+        build_group_stage(x_axis, measures, series_by, with_moments=True, time_grain=time_grain, timezone=timezone,
+                          with_totals=with_totals),
+        *build_order_stages(measures, series_by, order_by=order_by, order=order),
+    ]
+
+
+def sample_rate(total_rows: int, sample_size: int) -> float:
+    if total_rows <= 0 or sample_size <= 0:
+        return 1.0
+    return min(1.0, sample_size / total_rows)
+
+
+def run_sampled_aggregate(collection, scope: dict, match_stage: dict, x_axis: str,
+                          measures: List[Measure], series_by: Optional[str], sample_size: int,
+                          source: str = "sampled_aggregate", time_grain: Optional[str] = None,
+                          timezone: Optional[str] = None, order_by: Optional[str] = None,
+                          order: Optional[str] = None):
+    """
+    Runs an approximate aggregate over a uniform sample of the rows in scope (usually
+    {"upload_id": ...}). Returns (result, sample rate, rows the rate applies to).
+    """
+    # Uploads are tagged all-or-nothing at ingest, so one document tells us which path to take.
+    # Cross-upload scopes may mix old and new uploads and always use $sample.
+    first_doc = collection.find_one(scope, {SAMPLE_FIELD: 1}) if scope else None
+    has_sample_field = bool(first_doc) and SAMPLE_FIELD in first_doc
+
+    if has_sample_field:
+        total_rows = collection.count_documents(scope)
+    else:
+        total_rows = collection.count_documents(match_stage)
+
+    rate = sample_rate(total_rows, sample_size)
+    pipeline = build_sample_pipeline(
+        match_stage, x_axis, measures, series_by, rate, sample_size, has_sample_field,
+        time_grain=time_grain, timezone=timezone, order_by=order_by, order=order,
+    )
+    return run_aggregate(collection, pipeline, source), rate, total_rows
+
+
+def fill_time_gaps(result: list, measures: List[Measure], time_grain: str,
+                   timezone: Optional[str] = None, series_by: Optional[str] = None,
+                   descending: bool = False) -> list:
+    """
+    Adds the empty buckets between the first and last time bucket (per series), with
+    count/sum measures as 0 and the rest as null. Runs on the grouped result, which is
+    already bounded, and steps in the requested timezone so DST/month lengths line up.
+    Returns the buckets in time order, newest first when descending.
+    """
+    def x_of(doc):
+        return doc["_id"].get("x") if series_by else doc["_id"]
+
+    dated = [doc for doc in result if x_of(doc) is not None]
+    if not dated:
+        return result
+
+    tz = timezone or "UTC"
+    # pymongo returns naive UTC datetimes
+    xs = pd.DatetimeIndex([x_of(doc) for doc in dated]).tz_localize("UTC").tz_convert(tz)
+    buckets = pd.date_range(xs.min(), xs.max(), freq=_GRAIN_FREQ[time_grain])
+    if len(buckets) > MAX_FILLED_BUCKETS:
+        raise ValueError(f"Gap filling would produce {len(buckets)} buckets; use a coarser time_grain")
+    buckets = [b.to_pydatetime() for b in buckets.tz_convert("UTC").tz_localize(None)]
+
+    series_values = sorted({doc["_id"].get("s") for doc in dated}, key=str) if series_by else [None]
+    present = {(x_of(doc), doc["_id"].get("s") if series_by else None) for doc in dated}
+
+    empty = {}
+    for i, measure in enumerate(measures):
+        empty[f"m{i}"] = 0 if measure.agg_func in ("count", "sum") else None
+
+    filled = list(result)
+    for bucket in buckets:
+        for series in series_values:
+            if (bucket, series) not in present:
+                group_id = {"x": bucket, "s": series} if series_by else bucket
+                filled.append({"_id": group_id, **empty})
+
+    # Two stable sorts: series ascending within each bucket, buckets in the requested direction
+    filled.sort(key=lambda doc: str(doc["_id"].get("s")) if series_by else "")
+    filled.sort(key=lambda doc: (x_of(doc) is not None, x_of(doc) or 0), reverse=descending)
+    return filled
+
+
+def _estimate(doc: dict, i: int, measure: Measure, rate: float):
+    """Returns (estimate, 95% error bound) for one measure of one sampled group"""
+    value = doc.get(f"m{i}")
+    if value is None:
+        return None, None
+
+    fpc = 1 - rate  # finite population correction, 0 when nothing was sampled out
+
+    if measure.agg_func == "count":
+        # Horvitz-Thompson: each sampled row stands for 1/rate rows
+        return value / rate, Z_SCORE * math.sqrt(fpc * value) / rate
+
+    if measure.agg_func == "sum":
+        sum_squares = doc.get(f"q{i}") or 0
+        return value / rate, Z_SCORE * math.sqrt(fpc * sum_squares) / rate
+
+    if measure.agg_func == "avg":
+        std_dev = doc.get(f"sd{i}")
+        count = doc.get(f"c{i}") or 0
+        if std_dev is None or count < 2:
+            return value, None
+        return value, Z_SCORE * std_dev * math.sqrt(fpc / count)
+
+    # min/max of a sample only bound the true value from one side; no symmetric error
+    return value, None
+
+
+def shape_estimates(result: list, measures: List[Measure], series_by: Optional[str],
+                    rate: float, total_rows: int) -> dict:
+    """Columnar shape with scaled estimates, per-value error bounds and sampling info"""
+    shaped = shape_columns(result, measures, series_by)
+    shaped["errors"] = {measure_key(m): [] for m in measures}
+
+    for row, doc in enumerate(result):
+        for i, measure in enumerate(measures):
+            key = measure_key(measure)
+            estimate, error = _estimate(doc, i, measure, rate)
+            shaped["values"][key][row] = estimate
+            shaped["errors"][key].append(error)
+
+    shaped["approximate"] = rate < 1
+    shaped["sample_size"] = sum(doc.get("n", 0) for doc in result)
+    shaped["sample_rate"] = rate
+    shaped["total_rows"] = total_rows
+    shaped["confidence"] = CONFIDENCE
+    return shaped
+
+
+def shape_rows(result: list, x_axis: str, y_axis: str) -> list:
+    """Legacy single-measure shape: [{x_axis: ..., y_axis: ...}, ...]"""
+    return [{x_axis: doc["_id"], y_axis: doc.get("m0")} for doc in result]
+
+
+def shape_columns(result: list, measures: List[Measure], series_by: Optional[str] = None) -> dict:
+    """Compact aligned shape: one array per axis/measure, index i describes group i"""
+    shaped = {"x": [], "values": {measure_key(m): [] for m in measures}}
+    if series_by:
+        shaped["series"] = []
+
+    for doc in result:
+        if series_by:
+            shaped["x"].append(doc["_id"].get("x"))
+            shaped["series"].append(doc["_id"].get("s"))
+        else:
+            shaped["x"].append(doc["_id"])
+        for i, measure in enumerate(measures):
+            shaped["values"][measure_key(measure)].append(doc.get(f"m{i}"))
+
+    return shaped
@@ -0,0 +1,112 @@
+import pandas as pd
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+from models.dataset import dataset_collection
+from models.schema_less import schema_less_collection
+from models.dataset_metadata import dataset_metadata_collection
+from lib.etag import bump_version, upload_key
+
+# dataset_metadata doubles as the upload catalog: one document per upload with
+# its source kind, filename, row count, byte size, created_at and a column
+# summary, written at ingest. Listing uploads is an indexed read on
+# (source, created_at) instead of a distinct() over every row.
+
+CATALOG_SORT_FIELDS = ("created_at", "row_count", "byte_size", "filename", "upload_id")
+CATALOG_PROJECTION = {
+    "_id": 0,
+    "upload_id": 1,
+    "source": 1,
+    "filename": 1,
+    "row_count": 1,
+    "byte_size": 1,
+    "created_at": 1,
+    "column_summary": 1,
+}
+MAX_PAGE_SIZE = 500
+SOURCE_COLLECTIONS = {"dataset": dataset_collection, "schemaless": schema_less_collection}
+
+
+def column_summary(df: pd.DataFrame, column_types: dict) -> dict:
+    """Type and non-null count per column"""
+    non_null = df.notna().sum()
+    return {col: {"type": column_types.get(col, "unknown"), "non_null": int(non_null[col])} for col in df.columns}
+
+
+def list_upload_ids(source: str) -> list:
+    cursor = dataset_metadata_collection.find({"source": source}, {"_id": 0, "upload_id": 1}).sort("created_at", ASCENDING)
+    upload_ids = [doc["upload_id"] for doc in cursor]
+
+    # Uploads backfill_catalog hasn't tagged yet (it runs after startup, and may have failed):
+    # look up which of them hold rows of this source
+    legacy = [doc["upload_id"] for doc in dataset_metadata_collection.find({"source": {"$exists": False}}, {"_id": 0, "upload_id": 1})]
+    if legacy:
+        upload_ids += SOURCE_COLLECTIONS[source].distinct("upload_id", {"upload_id": {"$in": legacy}})
+    return upload_ids
+
+
+def list_catalog(source: str, sort: str = "created_at", order: str = "desc", skip: int = 0, limit: int = 50) -> dict:
+    if sort not in CATALOG_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Choose from {list(CATALOG_SORT_FIELDS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid order. Choose from ['asc', 'desc']")
+    if skip < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"skip must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+
+    query = {"source": source}
+    direction = ASCENDING if order == "asc" else DESCENDING
+    items = list(
+        dataset_metadata_collection.find(query, CATALOG_PROJECTION)
+        .sort([(sort, direction), ("upload_id", direction)])
+        .skip(skip)
+        .limit(limit)
+    )
+    return {
+        "total": dataset_metadata_collection.count_documents(query),
+        "skip": skip,
+        "limit": limit,
+        "items": items,
+    }
+
+
+def backfill_catalog():
+    """One-off fill of source/row_count for uploads ingested before the catalog existed"""
+    legacy = dataset_metadata_collection.find({"source": {"$exists": False}}, {"_id": 1, "upload_id": 1})
+    for meta in legacy:
+        for source, collection in SOURCE_COLLECTIONS.items():
+            row_count = collection.count_documents({"upload_id": meta["upload_id"]})
+            if row_count:
+                dataset_metadata_collection.update_one(
+                    {"_id": meta["_id"]},
+                    {"$set": {"source": source, "row_count": row_count}},
+                )
+                break
+
+
+def backfill_column_types():
+    """
+    One-off fix of schemaless column types recorded before detect_stored_type: integer columns
+    such as Year were recorded as "date" though stored as numbers, so filters and time grains
+    compared them as dates. Uploads are marked types_checked once done.
+    """
+    legacy = dataset_metadata_collection.find(
+        {"source": "schemaless", "types_checked": {"$exists": False}},
+        {"_id": 1, "upload_id": 1, "column_types": 1, "column_summary": 1},
+    )
+    for meta in legacy:
+        column_types = dict(meta.get("column_types") or {})
+        summary = meta.get("column_summary") or {}
+        numeric = [
+            col for col, column_type in column_types.items()
+            if column_type == "date"
+            and schema_less_collection.find_one({"upload_id": meta["upload_id"], col: {"$type": "number"}}, {"_id": 1})
+        ]
+        update = {"types_checked": True}
+        if numeric:
+            for col in numeric:
+                column_types[col] = "numeric"
+                if col in summary:
+                    summary[col] = {**summary[col], "type": "numeric"}
+            update.update({"column_types": column_types, "column_summary": summary})
+        dataset_metadata_collection.update_one({"_id": meta["_id"]}, {"$set": update})
+        if numeric:
+            bump_version(upload_key(meta["upload_id"]))
@@ -0,0 +1,304 @@
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from pydantic import ValidationError
+from schemas.chart import AggregateRequest
+from schemas.dataset import DATASET_COLUMN_TYPES
+from schemas.schema_less import SchemalessAggregateRequest
+from schemas.parquet import ParquetAggregateRequest
+from lib.filters import compile_filter, merge_match
+from lib.aggregation import (
+    resolve_measures, validate_time_grain, validate_ranking, build_aggregate_pipeline, run_sampled_aggregate, fill_time_gaps,
+    shape_rows, shape_columns, shape_estimates
+)
+from lib.slow_query import run_aggregate
+from lib.etag import CHARTS_KEY, DATASETS_KEY, bump_version, get_versions, upload_key
+from models.chart import charts_collection
+from models.dataset import dataset_collection
+from models.schema_less import schema_less_collection
+from models.parquet import parquet_collection
+from models.dataset_metadata import dataset_metadata_collection
+
+
+def _require_date_axis(x_axis: str, column_types: dict):
+    if column_types.get(x_axis) != "date":
+        raise HTTPException(status_code=400, detail=f"time_grain requires a date x_axis; '{x_axis}' is not a date column")
+
+
+def _fill_gaps(request, result: list, measures: list) -> list:
+    if not (request.time_grain and request.fill_gaps):
+        return result
+    try:
+        # Parquet aggregates have no ordering options
+        descending = getattr(request, "order", None) == "desc"
+        return fill_time_gaps(result, measures, request.time_grain, request.timezone, request.series_by, descending)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def aggregate_datasets(request: AggregateRequest):
+    """Runs a /chart/aggregate request against the datasets collection"""
+    try:
+        measures = resolve_measures(request.y_axis, request.agg_func, request.measures)
+        validate_time_grain(request.time_grain, request.timezone)
+        validate_ranking(
+            request.top_n, request.order_by, request.order, request.time_grain, request.approximate, request.fill_gaps
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if request.time_grain:
+        _require_date_axis(request.x_axis, DATASET_COLUMN_TYPES)
+
+    # Match Stage
+    match_stage = {}
+    if request.upload_id:
+        match_stage["upload_id"] = request.upload_id
+
+    if request.year_from or request.year_to:
+        match_stage["year"] = {}
+        if request.year_from:
+            match_stage["year"]["$gte"] = int(request.year_from)
+        if request.year_to:
+            match_stage["year"]["$lte"] = int(request.year_to)
+
+    if request.filters:
+        try:
+            match_stage = merge_match(match_stage, compile_filter(request.filters, DATASET_COLUMN_TYPES))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if request.approximate:
+        scope = {"upload_id": request.upload_id} if request.upload_id else {}
+        result, rate, total_rows = run_sampled_aggregate(
+            dataset_collection, scope, match_stage, request.x_axis, measures, request.series_by, request.sample_size,
+            source="chart.aggregate", time_grain=request.time_grain, timezone=request.timezone,
+            order_by=request.order_by, order=request.order,
+        )
+        if not result:
+            raise HTTPException(status_code=404, detail="No records found")
+        result = _fill_gaps(request, result, measures)
+        return shape_estimates(result, measures, request.series_by, rate, total_rows)
+
+    pipeline = build_aggregate_pipeline(
+        match_stage, request.x_axis, measures, request.series_by,
+        time_grain=request.time_grain, timezone=request.timezone,
+        top_n=request.top_n, order_by=request.order_by, order=request.order,
+    )
+
+    result = run_aggregate(dataset_collection, pipeline, "chart.aggregate")
+
+    if not result:
+        raise HTTPException(status_code=404, detail="No records found")
+
+    result = _fill_gaps(request, result, measures)
+
+    if request.measures or request.series_by:
+        return shape_columns(result, measures, request.series_by)
+    return shape_rows(result, request.x_axis, request.y_axis)
+
+
+def aggregate_schemaless(request: SchemalessAggregateRequest):
+    """Runs a /schemaless/aggregate request against the schema_less collection"""
+    upload_id = request.upload_id
+
+    try:
+        measures = resolve_measures(request.y_axis, request.agg_func, request.measures)
+        validate_time_grain(request.time_grain, request.timezone)
+        validate_ranking(
+            request.top_n, request.order_by, request.order, request.time_grain, request.approximate, request.fill_gaps
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    match_stage = {"upload_id": upload_id}
+
+    if request.filters or request.time_grain:
+        metadata = dataset_metadata_collection.find_one({"upload_id": upload_id}, {"_id": 0, "column_types": 1})
+        if not metadata:
+            raise HTTPException(status_code=404, detail="No metadata found for this upload_id")
+        column_types = metadata["column_types"]
+
+        if request.time_grain:
+            _require_date_axis(request.x_axis, column_types)
+
+        if request.filters:
+            try:
+                match_stage = merge_match(match_stage, compile_filter(request.filters, column_types))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+    if request.approximate:
+        try:
+            result, rate, total_rows = run_sampled_aggregate(
+                schema_less_collection, {"upload_id": upload_id}, match_stage,
+                request.x_axis, measures, request.series_by, request.sample_size,
+                source="schemaless.aggregate", time_grain=request.time_grain, timezone=request.timezone,
+                order_by=request.order_by, order=request.order,
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not result:
+            raise HTTPException(status_code=404, detail="No matching data found for aggregation")
+        result = _fill_gaps(request, result, measures)
+        return shape_estimates(result, measures, request.series_by, rate, total_rows)
+
+    pipeline = build_aggregate_pipeline(
+        match_stage, request.x_axis, measures, request.series_by,
+        time_grain=request.time_grain, timezone=request.timezone,
+        top_n=request.top_n, order_by=request.order_by, order=request.order,
+    )
+
+    # --- Execute and return ---
+    try:
+        result = run_aggregate(schema_less_collection, pipeline, "schemaless.aggregate")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not result:
+        raise HTTPException(status_code=404, detail="No matching data found for aggregation")
+
+    result = _fill_gaps(request, result, measures)
+
+    if request.measures or request.series_by:
+        return shape_columns(result, measures, request.series_by)
+    return shape_rows(result, request.x_axis, request.y_axis)
+
+
+def aggregate_parquet(request: ParquetAggregateRequest):
+    """Runs a /parquet/aggregate request against the parquet collection"""
+    try:
+        measures = resolve_measures(request.y_axis, request.agg_func, request.measures)
+        validate_time_grain(request.time_grain, request.timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pipeline = build_aggregate_pipeline(
+        {"upload_id": request.upload_id},
+        request.x_axis,
+        measures,
+        request.series_by,
+        time_grain=request.time_grain,
+        timezone=request.timezone,
+    )
+
+    try:
+        result = run_aggregate(parquet_collection, pipeline, "parquet.aggregate")
+    except Exception as e:
+        print(f"[DEBUG] An exception occurred in parquet_aggregate: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while aggregating chart data.")
+
+    if not result:
+        raise HTTPException(status_code=404, detail="No matching data found for aggregation")
+
+    result = _fill_gaps(request, result, measures)
+
+    if request.measures or request.series_by:
+        return shape_columns(result, measures, request.series_by)
+    return shape_rows(result, request.x_axis, request.y_axis)
+
+
+# --- Materialized chart results ---
+# Charts saved with materialize=True keep their computed series under
+# "materialized", tagged with the version of the data they were computed from.
+# Views serve that copy; recomputation only happens on save/update and in
+# background tasks when the source version moves on.
+
+# Chart mode -> (request model, aggregate) used to recompute a saved chart
+CHART_MODES = {
+    "aggregated": (AggregateRequest, aggregate_datasets),
+    "schemaless": (SchemalessAggregateRequest, aggregate_schemaless),
+    "parquet": (ParquetAggregateRequest, aggregate_parquet),
+}
+
+
+def source_key(chart: dict) -> str:
+    """Version key of the data a saved chart reads"""
+    if chart.get("upload_id"):
+        return upload_key(chart["upload_id"])
+    return DATASETS_KEY
+
+
+def compute_chart(chart: dict):
+    """Recomputes a saved chart's series from its stored definition"""
+    if chart.get("mode") not in CHART_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Can't materialize charts with mode '{chart.get('mode')}'. Choose from {list(CHART_MODES)}",
+        )
+    request_type, run = CHART_MODES[chart["mode"]]
+
+    fields = {k: v for k, v in chart.items() if k in request_type.model_fields and v is not None}
+    try:
+        request = request_type(**fields)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Chart can't be computed: {e}")
+    return run(request)
+
+
+def compute_materialized(chart: dict) -> dict:
+    """Computes a chart's series, tagged with the source version it was computed from"""
+    key = source_key(chart)
+    # Read the version first, so an upload landing mid-computation leaves the result stale
+    version = get_versions(key)[key]
+    try:
+        data = compute_chart(chart)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        data = []
+
+    return {
+        "data": data,
+        "source_key": key,
+        "source_version": version,
+        "computed_at": datetime.now(timezone.utc),
+    }
+
+
+def materialize_chart(chart: dict) -> dict:
+    """Computes and stores a saved chart's series"""
+    materialized = compute_materialized(chart)
+    charts_collection.update_one({"_id": chart["_id"]}, {"$set": {"materialized": materialized}})
+    return materialized
+
+
+def stale_chart_ids(charts: list) -> list:
+    """Ids of materialized charts whose stored result predates their source data"""
+    charts = [c for c in charts if c.get("materialize")]
+    if not charts:
+        return []
+
+    versions = get_versions(*{source_key(c) for c in charts})
+    stale = []
+    for chart in charts:
+        materialized = chart.get("materialized") or {}
+        if materialized.get("source_version") != versions[source_key(chart)]:
+            stale.append(chart["_id"])
+    return stale
+
+
+def refresh_charts(chart_ids: list):
+    """Background task: recomputes the given materialized charts if they are still stale"""
+    charts = list(charts_collection.find({"_id": {"$in": chart_ids}, "materialize": True}))
+    stale = set(stale_chart_ids(charts))
+    refreshed = 0
+    for chart in charts:
+        if chart["_id"] not in stale:
+            continue
+        try:
+            materialize_chart(chart)
+            refreshed += 1
+        except Exception as e:
+            print(f"Could not refresh chart {chart['_id']}:", e)
+
+    if refreshed:
+        bump_version(CHARTS_KEY)
+
+
+def refresh_dependent_charts(key: str):
+    """Background task: recomputes materialized charts that read the data behind a version key"""
+    charts = charts_collection.find(
+        {"materialize": True, "$or": [{"materialized.source_key": key}, {"materialized": {"$exists": False}}]},
+        {"_id": 1},
+    )
+    refresh_charts([chart["_id"] for chart in charts])
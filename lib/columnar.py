@@ -0,0 +1,103 @@
+from typing import List, Literal, Optional
+import pandas as pd
+import pyarrow as pa
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Opt-in columnar encodings for the row endpoints. Row arrays repeat every key
+# on every row; here each column is sent once, and low-cardinality string
+# columns are dictionary-encoded as {"dictionary": [...], "codes": [...]}.
+
+ResponseFormat = Literal["rows", "columnar", "arrow"]
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.vizly.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# The format may come from the Accept header, so caches must key responses on it
+VARY_HEADERS = {"Vary": "Accept"}
+
+# Dictionary-encode a string column when distinct values are at most this share of rows
+DICTIONARY_MAX_RATIO = 0.5
+
+
+def negotiate_format(request: Request, format: Optional[str] = None) -> ResponseFormat:
+    """Picks the response format from ?format=, falling back to the Accept header"""
+    if format:
+        if format not in ("rows", "columnar", "arrow"):
+            raise HTTPException(status_code=400, detail="Invalid format. Choose from ['rows', 'columnar', 'arrow']")
+        return format
+
+    accept = request.headers.get("accept", "")
+    if ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    return "rows"
+
+
+def _frame(records: list, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Object-dtype frame holding the records' values as-is. from_records would turn
+    integer columns with nulls into float64 (2020 -> 2020.0), unlike the rows format.
+    """
+    if columns is None:
+        columns = list(dict.fromkeys(key for record in records for key in record))
+    return pd.DataFrame({col: pd.Series([record.get(col) for record in records], dtype=object) for col in columns})
+
+
+def _is_low_cardinality_strings(series: pd.Series) -> bool:
+    if series.dtype != object:
+        return False
+    non_null = series.dropna()
+    if non_null.empty or not non_null.map(lambda v: isinstance(v, str)).all():
+        return False
+    return non_null.nunique() <= len(series) * DICTIONARY_MAX_RATIO
+
+
+def to_columnar(records: list, columns: Optional[List[str]] = None) -> dict:
+    """Builds {"columns", "length", "data"} with one array (or dictionary encoding) per column"""
+    df = _frame(records, columns)
+    data = {}
+    for col in df.columns:
+        series = df[col]
+        if _is_low_cardinality_strings(series):
+            codes, uniques = pd.factorize(series)
+            data[col] = {
+                "dictionary": uniques.tolist(),
+                "codes": [int(c) if c >= 0 else None for c in codes],
+            }
+        else:
+            data[col] = series.astype(object).where(series.notna(), None).tolist()
+
+    return {"columns": list(df.columns), "length": len(df), "data": data}
+
+
+def _arrow_column(series: pd.Series) -> pa.Array:
+    if _is_low_cardinality_strings(series):
+        return pa.array(series, from_pandas=True).dictionary_encode()
+    try:
+        return pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type schemaless columns: fall back to their string form
+        return pa.array(series.astype(object).where(series.isna(), series.astype(str)), from_pandas=True)
+
+
+def to_arrow(records: list, columns: Optional[List[str]] = None) -> bytes:
+    """Serializes the records as an Arrow IPC stream"""
+    df = _frame(records, columns)
+    table = pa.table({str(col): _arrow_column(df[col]) for col in df.columns})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def format_records(records: list, response_format: ResponseFormat, columns: Optional[List[str]] = None):
+    """Response with the records in the negotiated format; "rows" sends them unchanged"""
+    if response_format == "columnar":
+        content = jsonable_encoder(to_columnar(records, columns))
+        return JSONResponse(content, media_type=COLUMNAR_MEDIA_TYPE, headers=VARY_HEADERS)
+    if response_format == "arrow":
+        return Response(content=to_arrow(records, columns), media_type=ARROW_MEDIA_TYPE, headers=VARY_HEADERS)
+    return JSONResponse(jsonable_encoder(records), headers=VARY_HEADERS)
@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.csv_reader import read_csv
+
+# --- Parse throughput of the upload CSV backends by core count ---
+# Generates a dataset-shaped CSV in memory and times pandas vs. Arrow at
+# 1, 2, 4, ... cores. Usage: python lib/csv_parser_benchmark.py [rows] [repeats]
+# Before timing, both backends must parse PARITY_CSV to the same frame.
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+
+# Columns where Arrow's inference differs from pandas unless read_csv corrects it
+# (the repeated count/label headers must come out as count.1/label.1)
+PARITY_CSV = b"""iso_date,timestamp,mixed_dates,time,empty,flag,count,label,count,label
+2024-01-01,2024-01-01 10:00,2024-01-01,12:30:00,,True,1,a,10,2024-01-01
+2024-02-01,2024-02-01 11:30,01/02/2024 10:00,13:00:00,,False,,b,20,2024-02-01
+2024-03-05,2024-03-05 09:15,March 3 2024,14:00:00,,true,3,,30,
+"""
+
+
+def check_parity():
+    expected = read_csv(io.BytesIO(PARITY_CSV), parser="pandas")
+    actual = read_csv(io.BytesIO(PARITY_CSV), parser="arrow")
+    pd.testing.assert_frame_equal(expected, actual)
+
+
+def make_csv(rows: int) -> bytes:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Model": rng.choice(["5 Series", "i8", "X3", "X5", "M3", "i3", "7 Series"], rows),
+        "Year": rng.integers(2010, 2025, rows),
+        "Region": rng.choice(["Asia", "Europe", "North America", "Africa", "Middle East"], rows),
+        "Color": rng.choice(["Black", "White", "Blue", "Red", "Silver"], rows),
+        "Transmission": rng.choice(["Manual", "Automatic"], rows),
+        "Mileage_KM": rng.uniform(0, 200_000, rows).round(1),
+        "Price_USD": rng.uniform(30_000, 120_000, rows).round(2),
+        "Sales_Volume": rng.integers(100, 10_000, rows),
+    })
+    # Sprinkle some missing values so null handling is exercised
+    df.loc[df.sample(frac=0.01, random_state=0).index, "Color"] = None
+    return df.to_csv(index=False).encode()
+
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    check_parity()
+    data = make_csv(ROWS)
+    size_mb = len(data) / 1024 / 1024
+    print(f"{ROWS:,} rows, {size_mb:.1f} MB, best of {REPEATS}\n")
+    print(f"{'parser':<8} {'cores':>5} {'seconds':>9} {'rows/s':>12} {'MB/s':>8}")
+
+    def report(parser, cores, seconds):
+        print(f"{parser:<8} {cores:>5} {seconds:>9.3f} {ROWS / seconds:>12,.0f} {size_mb / seconds:>8.1f}")
+
+    report("pandas", 1, best_of(lambda: read_csv(io.BytesIO(data), parser="pandas"), REPEATS))
+
+    max_cores = os.cpu_count() or 1
+    core_counts = sorted({min(2 ** i, max_cores) for i in range(max_cores.bit_length() + 1)})
+    for cores in core_counts:
+        pa.set_cpu_count(cores)
+        report("arrow", cores, best_of(lambda: read_csv(io.BytesIO(data), parser="arrow"), REPEATS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+from typing import Iterable
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# CSV parser backend for the upload endpoints, picked by CSV_PARSER:
+#   "pandas" (default) - pd.read_csv, single-threaded
+#   "arrow"            - pyarrow's multithreaded CSV reader, converted to pandas
+# CSV_PARSER_THREADS caps the threads Arrow uses (defaults to all cores).
+# Both return a DataFrame the upload code treats identically. text_columns names
+# columns to keep as text rather than infer (matched like the routers match
+# headers: stripped, case-insensitive), so e.g. a model "3" stays "3".
+
+CSV_PARSER = os.getenv("CSV_PARSER", "pandas").lower()
+CSV_PARSER_THREADS = os.getenv("CSV_PARSER_THREADS")
+ARROW_BLOCK_SIZE = int(os.getenv("CSV_PARSER_BLOCK_SIZE", str(4 * 1024 * 1024)))
+
+if CSV_PARSER_THREADS:
+    pa.set_cpu_count(int(CSV_PARSER_THREADS))
+
+# pandas' default NA markers, so both backends null out the same cells
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def _arrow_convert_options(column_types: dict = None) -> pacsv.ConvertOptions:
+    return pacsv.ConvertOptions(
+        null_values=PANDAS_NA_VALUES,
+        strings_can_be_null=True,
+        true_values=["True", "TRUE", "true"],
+        false_values=["False", "FALSE", "false"],
+        column_types=column_types or {},
+    )
+
+
+def _is_text_column(name: str, text_columns) -> bool:
+    return name.strip().lower() in text_columns
+
+
+def _dedup_names(names: list) -> list:
+    """
+    pd.read_csv's renaming of repeated headers: sales, sales -> sales, sales.1, skipping
+    suffixes that are already headers of their own (a, a, a.1 -> a, a.2, a.1)
+    """
+    names = list(names)
+    counts = {}
+    for i, name in enumerate(names):
+        count = counts.get(name, 0)
+        if count > 0:
+            base = name
+            while count > 0:
+                counts[base] = count + 1
+                name = f"{base}.{count}"
+                count = count + 1 if name in names else counts.get(name, 0)
+            names[i] = name
+        counts[name] = count + 1
+    return names
+
+
+def _read_csv_arrow(fileobj, text_columns: set) -> pd.DataFrame:
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=ARROW_BLOCK_SIZE)
+    start = fileobj.tell()
+    table = pacsv.read_csv(fileobj, read_options=read_options, convert_options=_arrow_convert_options())
+    names = _dedup_names(table.column_names)
+
+    # pandas leaves date-like text as strings. Arrow's inference can't be switched off, and casting
+    # its timestamps back rewrites the text ("2024-01-01" -> "2024-01-01 00:00:00"), so re-read
+    # those columns as strings to keep the original text for type detection
+    as_text = {
+        name: pa.string()
+        for name, field in zip(names, table.schema)
+        if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type) or pa.types.is_time(field.type)
+        or (_is_text_column(name, text_columns) and not pa.types.is_string(field.type))
+    }
+    if as_text or names != table.column_names:
+        # Arrow keeps repeated headers as is; re-read under the deduplicated names instead
+        # (skipping the header row), which also lets column_types address each column
+        fileobj.seek(start)
+        read_options = pacsv.ReadOptions(
+            use_threads=True, block_size=ARROW_BLOCK_SIZE, column_names=names, skip_rows=1
+        )
+        table = pacsv.read_csv(fileobj, read_options=read_options, convert_options=_arrow_convert_options(as_text))
+
+    # Columns with no values at all: pandas reads them as float64 NaN
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+
+    return table.to_pandas()
+
+
+def _read_csv_pandas(fileobj, text_columns: set) -> pd.DataFrame:
+    dtype = None
+    if text_columns:
+        start = fileobj.tell()
+        header = pd.read_csv(fileobj, nrows=0).columns
+        fileobj.seek(start)
+        dtype = {name: str for name in header if _is_text_column(name, text_columns)}
+    return pd.read_csv(fileobj, dtype=dtype)
+
+
+def read_csv(fileobj, parser: str = None, text_columns: Iterable[str] = ()) -> pd.DataFrame:
+    """Parses an uploaded CSV with the configured backend"""
+    parser = parser or CSV_PARSER
+    text_columns = {name.lower() for name in text_columns}
+    if parser == "arrow":
+        return _read_csv_arrow(fileobj, text_columns)
+    if parser == "pandas":
+        return _read_csv_pandas(fileobj, text_columns)
+    raise ValueError(f"Unknown CSV_PARSER '{parser}'. Choose from ['pandas', 'arrow']")
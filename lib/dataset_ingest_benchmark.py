@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.aggregation import SAMPLE_FIELD
+from lib.csv_reader import read_csv
+from lib.dataset_ingest import build_dataset_documents, dataset_field_type
+from schemas.dataset import Dataset
+
+# --- Dataset upload validation: per-row pydantic vs. column-wise ---
+# Builds a parsed dataset-shaped frame and times turning it into insertable
+# documents both ways (no Mongo involved). Before timing, SANITY_CSV must come
+# out of both CSV backends as SANITY_EXPECTED.
+# Usage: python lib/dataset_ingest_benchmark.py [rows] [repeats]
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+COLUMNS = ["model", "year", "region", "color", "transmission", "mileage_km", "price_usd", "sales_volume"]
+
+# Numeric-looking model names next to a blank cell must stay text, not become "3.0"
+SANITY_CSV = b"""Model,Year,Mileage_KM
+3,2020,100.5
+,2021,
+5,2022,300
+"""
+SANITY_EXPECTED = {
+    "model": ["3", None, "5"],
+    "year": [2020, 2021, 2022],
+    "mileage_km": [100.5, None, 300.0],
+}
+
+
+def check_sanity():
+    text_columns = [col for col in COLUMNS if dataset_field_type(col) is str]
+    for parser in ("pandas", "arrow"):
+        df = read_csv(io.BytesIO(SANITY_CSV), parser=parser, text_columns=text_columns)
+        df.columns = [col.strip().lower() for col in df.columns]
+        documents = build_dataset_documents(df, list(SANITY_EXPECTED), "sanity")
+        actual = {col: [doc[col] for doc in documents] for col in SANITY_EXPECTED}
+        assert actual == SANITY_EXPECTED, f"{parser}: {actual}"
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "model": rng.choice(["5 Series", "i8", "X3", "X5", "M3", "i3", "7 Series"], rows),
+        "year": rng.integers(2010, 2025, rows),
+        "region": rng.choice(["Asia", "Europe", "North America", "Africa", "Middle East"], rows),
+        "color": rng.choice(["Black", "White", "Blue", "Red", "Silver"], rows),
+        "transmission": rng.choice(["Manual", "Automatic"], rows),
+        "mileage_km": rng.uniform(0, 200_000, rows).round(1),
+        "price_usd": rng.uniform(30_000, 120_000, rows).round(2),
+        "sales_volume": rng.integers(100, 10_000, rows),
+    })
+    # Some missing values, as read_csv would leave them
+    df.loc[df.sample(frac=0.01, random_state=0).index, "color"] = None
+    df.loc[df.sample(frac=0.01, random_state=1).index, "mileage_km"] = np.nan
+    return df
+
+
+def per_row(df: pd.DataFrame, upload_id: str) -> list:
+    """The previous upload path: records dicts, then one Dataset model per row"""
+    df = df.astype(object).where(pd.notnull(df), None)
+    records = df.to_dict(orient="records")
+    for idx, record in enumerate(records, start=1):
+        record["upload_id"] = upload_id
+        record["row_id"] = idx
+    valid_records = [Dataset(**rec).model_dump() for rec in records]
+    for record, key in zip(valid_records, np.random.random(len(valid_records))):
+        record[SAMPLE_FIELD] = float(key)
+    return valid_records
+
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    check_sanity()
+    df = make_frame(ROWS)
+    print(f"{ROWS:,} rows, best of {REPEATS}\n")
+    print(f"{'path':<12} {'seconds':>9} {'rows/s':>12}")
+
+    def report(path, seconds):
+        print(f"{path:<12} {seconds:>9.3f} {ROWS / seconds:>12,.0f}")
+
+    before = best_of(lambda: per_row(df, "bench"), REPEATS)
+    report("per-row", before)
+    after = best_of(lambda: build_dataset_documents(df, COLUMNS, "bench"), REPEATS)
+    report("column-wise", after)
+    print(f"\nspeedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import hashlib
+from typing import Optional
+from fastapi import Request, Response
+from models.version import versions_collection
+
+# Polled endpoints carry an ETag derived from version counters that every write
+# bumps, so a conditional GET costs one _id lookup instead of the real queries.
+# Bump ETAG_SCHEMA when a response shape changes so clients don't keep stale bodies.
+
+ETAG_SCHEMA = "1"
+CHARTS_KEY = "charts"
+DATASETS_KEY = "datasets"
+
+
+def upload_key(upload_id: str) -> str:
+    return f"upload:{upload_id}"
+
+
+def dashboard_key(mode: str, upload_id: Optional[str]) -> str:
+    return f"dashboard:{mode}:{upload_id}"
+
+
+def bump_version(*keys: str):
+    for key in keys:
+        versions_collection.update_one({"_id": key}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def get_versions(*keys: str) -> dict:
+    """Current version of each key (0 if it was never bumped), in one query"""
+    docs = versions_collection.find({"_id": {"$in": list(keys)}})
+    versions = {doc["_id"]: doc.get("version", 0) for doc in docs}
+    return {key: versions.get(key, 0) for key in keys}
+
+
+def compute_etag(*keys: str) -> str:
+    versions = get_versions(*keys)
+    raw = ETAG_SCHEMA + "|" + "|".join(f"{key}={versions[key]}" for key in keys)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def check_etag(request: Request, response: Response, *keys: str) -> Optional[Response]:
+    """
+    Returns a 304 response if the client's If-None-Match is current, otherwise
+    sets the ETag on the outgoing response and returns None.
+    """
+    etag = compute_etag(*keys)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,247 @@
+import csv
+import io
+import itertools
+import os
+import zlib
+from typing import Iterable, Iterator, List, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from lib.dataset_ingest import dataset_field_type
+from lib.slow_query import run_aggregate
+
+# Streaming CSV/Parquet exports. Rows are pulled from a Mongo cursor in batches
+# of EXPORT_BATCH_SIZE, each batch is encoded and handed to the client before
+# the next is read, so server memory stays at one batch however large the
+# export. Parquet writes one row group per batch. gzip=True compresses the CSV
+# stream (served as .csv.gz) or switches Parquet's column compression to gzip.
+# The Parquet schema is fixed up front from the known column types, and every
+# batch is cast to it with a checked cast, so a value that doesn't fit fails
+# the export instead of being truncated.
+
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "csv.gz": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Arrow types for the column types recorded in dataset_metadata
+ARROW_TYPES = {
+    "numeric": pa.float64(),  # ints and doubles may share a schemaless column
+    "date": pa.timestamp("ms"),
+    "boolean": pa.bool_(),
+    "categorical": pa.string(),
+    "unknown": pa.string(),
+}
+# Fields added to every row at ingest
+INGEST_FIELDS = {"upload_id": pa.string(), "row_id": pa.int64()}
+
+_PYTHON_ARROW_TYPES = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+
+# BSON $type names, for uploads without recorded column types
+_BSON_INTEGERS = {"int", "long"}
+_BSON_NUMBERS = {"int", "long", "double", "decimal"}
+_BSON_ARROW_TYPES = {"date": pa.timestamp("ms"), "bool": pa.bool_(), "string": pa.string()}
+# Stored BSON types each recorded column type can be written from (text columns take anything)
+_RECORDED_BSON_TYPES = {"numeric": _BSON_NUMBERS, "date": {"date"}, "boolean": {"bool"}}
+
+
+def validate_export_format(format: str):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Choose from {list(EXPORT_FORMATS)}")
+
+
+def iter_batches(rows: Iterable[dict], size: int = EXPORT_BATCH_SIZE) -> Iterator[List[dict]]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def _csv_chunks(batches: Iterable[List[dict]], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    # Keys outside the header (schemaless rows may differ) are left out
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what ParquetWriter emits until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def arrow_schema(columns: List[str], column_types: dict, stored: Optional[dict] = None) -> pa.Schema:
+    """
+    Parquet schema from recorded column types (numeric/date/boolean/categorical). Given the
+    stored BSON types (see stored_types), a recorded type the stored values don't fit falls
+    back to the stored type: legacy uploads recorded integer years and non-ISO text dates
+    as "date", which would otherwise be cast to 1970 timestamps or fail mid-export.
+    """
+    stored = stored or {}
+    fields = []
+    for col in columns:
+        if col in column_types:
+            recorded = column_types[col]
+            types = stored.get(col)
+            if types and recorded in _RECORDED_BSON_TYPES and not types <= _RECORDED_BSON_TYPES[recorded]:
+                arrow_type = _stored_arrow_type(types)
+            else:
+                arrow_type = ARROW_TYPES.get(recorded, pa.string())
+            fields.append(pa.field(col, arrow_type))
+        else:
+            fields.append(pa.field(col, INGEST_FIELDS.get(col, pa.string())))
+    return pa.schema(fields)
+
+
+def dataset_schema(columns: List[str]) -> pa.Schema:
+    """Parquet schema from the Dataset model's field types"""
+    return pa.schema([pa.field(col, _PYTHON_ARROW_TYPES[dataset_field_type(col)]) for col in columns])
+
+
+def stored_types(collection, query: dict, columns: List[str], source: str) -> dict:
+    """Non-null BSON $type names stored in each column under query. Costs one extra pass over the rows."""
+    pipeline = [
+        {"$match": query},
+        {"$project": {"_id": 0, "fields": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$fields"},
+        {"$match": {"fields.k": {"$in": columns}}},
+        {"$group": {"_id": "$fields.k", "types": {"$addToSet": {"$type": "$fields.v"}}}},
+    ]
+    return {doc["_id"]: set(doc["types"]) - {"null"} for doc in run_aggregate(collection, pipeline, source)}
+
+
+def _stored_arrow_type(types: set) -> pa.DataType:
+    if types and types <= _BSON_INTEGERS:
+        return pa.int64()
+    if types and types <= _BSON_NUMBERS:
+        return pa.float64()
+    if len(types) == 1:
+        return _BSON_ARROW_TYPES.get(next(iter(types)), pa.string())
+    return pa.string()  # mixed, or null throughout
+
+
+def collection_schema(collection, query: dict, columns: List[str], source: str) -> pa.Schema:
+    """Parquet schema from the BSON types actually stored under query, for uploads with no recorded column types"""
+    stored = stored_types(collection, query, columns, source)
+    return pa.schema([pa.field(col, _stored_arrow_type(stored.get(col, set()))) for col in columns])
+
+
+def infer_schema(rows: List[dict], columns: List[str]) -> pa.Schema:
+    """Parquet schema inferred over all of the rows (for already reduced, in-memory results)"""
+    fields = []
+    for col in columns:
+        try:
+            arrow_type = pa.array([row.get(col) for row in rows]).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrow_type = pa.string()  # e.g. numeric x values next to the "(other)" group
+        if pa.types.is_null(arrow_type):
+            arrow_type = pa.string()
+        fields.append(pa.field(col, arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_column(values: list, field_type: pa.DataType) -> pa.Array:
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        if not pa.types.is_string(field_type):
+            raise
+        # Mixed-type text column: write each value's string form
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    # Checked cast: e.g. 2.5 into an int64 column raises instead of becoming 2
+    return array.cast(field_type, safe=True)
+
+
+def _parquet_chunks(batches: Iterable[List[dict]], schema: pa.Schema, compression: str) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in batches:
+            arrays = [_arrow_column([row.get(field.name) for row in batch], field.type) for field in schema]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_response(batches: Iterable[List[dict]], columns: List[str], format: str, gzip: bool,
+                    filename: str, schema: Optional[pa.Schema] = None) -> StreamingResponse:
+    """Streams the batches as a CSV or Parquet download; Parquet needs the schema of the columns"""
+    validate_export_format(format)
+    if format == "parquet":
+        chunks = _parquet_chunks(batches, schema, compression="gzip" if gzip else "snappy")
+        extension = "parquet"
+    else:
+        chunks = _csv_chunks(batches, columns)
+        extension = "csv"
+        if gzip:
+            chunks = _gzip_chunks(chunks)
+            extension = "csv.gz"
+
+    # A sync generator: Starlette iterates it in a threadpool, so cursor reads don't block the loop
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[extension],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
+
+
+def aggregate_rows(shaped, x_axis: str, series_by: Optional[str] = None):
+    """Flattens any aggregate response shape into (rows, columns) for export"""
+    if isinstance(shaped, list):
+        # Legacy single-measure rows are already flat
+        columns = list(shaped[0].keys()) if shaped else [x_axis]
+        return shaped, columns
+
+    columns = [x_axis]
+    arrays = [shaped["x"]]
+    if series_by:
+        columns.append(series_by)
+        arrays.append(shaped["series"])
+    for key, values in shaped["values"].items():
+        columns.append(key)
+        arrays.append(values)
+    for key, errors in (shaped.get("errors") or {}).items():
+        columns.append(f"{key}_error")
+        arrays.append(errors)
+
+    return [dict(zip(columns, row)) for row in zip(*arrays)], columns
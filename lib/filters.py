@@ -0,0 +1,158 @@
+import pandas as pd
+from typing import Any, Dict
+from lib.utils import BOOL_VALUES
+from schemas.filter import FilterCondition, FilterExpr
+
+# Filter expressions are compiled into a plain $match document so Mongo can
+# use the upload_id / column indexes instead of the client filtering raw rows.
+# Schemaless uploads ingested before columns were coerced at ingest store
+# dates and booleans as text, so date conditions compare the converted value
+# ($convert, as time_grain bucketing does) and boolean conditions also accept
+# the text forms of the value.
+
+_COMPARISON_OPS = {"eq": "$eq", "ne": "$ne", "gt": "$gt", "gte": "$gte", "lt": "$lt", "lte": "$lte"}
+_RANGE_OPS = {"gt", "gte", "lt", "lte", "between"}
+
+
+def coerce_value(value: Any, column_type: str) -> Any:
+    """Converts a filter value to the type the column is stored as. Raises ValueError."""
+    if value is None:
+        return None
+    if isinstance(value, (list, dict)):
+        raise ValueError(f"Expected a single value, got {value!r}")
+
+    if column_type == "numeric":
+        if isinstance(value, bool):
+            raise ValueError(f"Expected a number, got {value!r}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"Expected a number, got {value!r}")
+        return int(number) if number.is_integer() else number
+
+    if column_type == "date":
+        parsed = pd.to_datetime(str(value), errors="coerce")
+        if pd.isna(parsed):
+            raise ValueError(f"Expected a date, got {value!r}")
+        return parsed.to_pydatetime()
+
+    if column_type == "boolean":
+        if isinstance(value, bool):
+            return value
+        key = str(value).strip().lower()
+        if key not in BOOL_VALUES:
+            raise ValueError(f"Expected a boolean, got {value!r}")
+        return BOOL_VALUES[key]
+
+    if column_type == "categorical":
+        return str(value)
+
+    return value
+
+
+def _bool_forms(value: bool) -> list:
+    """The boolean plus the text forms older uploads stored it as"""
+    texts = [key for key, parsed in BOOL_VALUES.items() if parsed is value]
+    return list(dict.fromkeys([value, *texts, *(t.capitalize() for t in texts), *(t.upper() for t in texts)]))
+
+
+def _as_date(column: str) -> dict:
+    return {"$convert": {"input": f"${column}", "to": "date", "onError": None, "onNull": None}}
+
+
+def _date_condition(column: str, op: str, value) -> dict:
+    """$expr over the stored value converted to a date, so BSON dates and ISO text both match"""
+    stored = _as_date(column)
+    if op in ("in", "nin"):
+        expr = {"$in": [stored, value]}
+        return {"$expr": expr if op == "in" else {"$not": [expr]}}
+    if op in ("eq", "ne"):
+        return {"$expr": {_COMPARISON_OPS[op]: [stored, value]}}
+    # In expressions null sorts below every date; keep range queries from matching missing values
+    return {"$expr": {"$and": [{"$ne": [stored, None]}, {_COMPARISON_OPS[op]: [stored, value]}]}}
+
+
+def _compile_condition(cond: FilterCondition, column_types: Dict[str, str]) -> dict:
+    if cond.column not in column_types:
+        raise ValueError(f"Unknown filter column '{cond.column}'")
+
+    column_type = column_types[cond.column]
+    op = cond.op
+
+    if op == "is_null":
+        return {cond.column: None}
+    if op == "not_null":
+        return {cond.column: {"$ne": None}}
+
+    if op in _RANGE_OPS and column_type == "boolean":
+        raise ValueError(f"Operator '{op}' is not supported on boolean column '{cond.column}'")
+
+    if op in ("in", "nin"):
+        if not isinstance(cond.value, list) or not cond.value:
+            raise ValueError(f"Operator '{op}' on '{cond.column}' requires a non-empty list value")
+        values = [coerce_value(v, column_type) for v in cond.value]
+        if column_type == "date":
+            return _date_condition(cond.column, op, values)
+        if column_type == "boolean":
+            values = list(dict.fromkeys(form for v in values for form in _bool_forms(v)))
+        return {cond.column: {f"${op}": values}}
+
+    if op == "between":
+        if not isinstance(cond.value, list) or len(cond.value) != 2:
+            raise ValueError(f"Operator 'between' on '{cond.column}' requires [low, high]")
+        low, high = (coerce_value(v, column_type) for v in cond.value)
+        bounds = {}
+        if low is not None:
+            bounds["$gte"] = low
+        if high is not None:
+            bounds["$lte"] = high
+        if not bounds:
+            raise ValueError(f"Operator 'between' on '{cond.column}' needs at least one bound")
+        if column_type == "date":
+            clauses = [_date_condition(cond.column, bound_op[1:], bound) for bound_op, bound in bounds.items()]
+            return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+        return {cond.column: bounds}
+
+    if cond.value is None:
+        raise ValueError(f"Operator '{op}' on '{cond.column}' requires a value")
+
+    value = coerce_value(cond.value, column_type)
+    if column_type == "date":
+        return _date_condition(cond.column, op, value)
+    if column_type == "boolean":
+        return {cond.column: {"$in" if op == "eq" else "$nin": _bool_forms(value)}}
+    if op == "eq":
+        return {cond.column: value}
+    return {cond.column: {_COMPARISON_OPS[op]: value}}
+
+
+def compile_filter(expr: FilterExpr, column_types: Dict[str, str]) -> dict:
+    """
+    Compiles a filter expression into a $match document, validating every column
+    against the upload's column types. Raises ValueError on invalid filters.
+    """
+    clauses = []
+    for cond in expr.conditions:
+        if isinstance(cond, FilterExpr):
+            compiled = compile_filter(cond, column_types)
+        else:
+            compiled = _compile_condition(cond, column_types)
+        if compiled:
+            clauses.append(compiled)
+
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {f"${expr.logic}": clauses}
+
+
+def merge_match(match_stage: dict, extra: dict) -> dict:
+    """Combines two $match documents, falling back to $and when keys overlap"""
+    if not extra:
+        return match_stage
+    if not match_stage:
+        return extra
+    if set(match_stage).isdisjoint(extra):
+        return {**match_stage, **extra}
+    return {"$and": [match_stage, extra]}
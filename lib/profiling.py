@@ -0,0 +1,58 @@
+import os
+from datetime import datetime, timezone
+from fastapi import Request
+from fastapi.responses import HTMLResponse, JSONResponse
+from models.diagnostics import ensure_capped_collections, profiles_collection
+
+# Opt-in per-request sampling profiler. Disabled unless PROFILING_ENABLED=true;
+# when PROFILING_TOKEN is set the caller must also send it as X-Profile-Token.
+#   ?profile=html (or X-Profile: html)  -> the profile is returned instead of the response
+#   ?profile=1    (or X-Profile: 1)     -> normal response, profile stored; id in X-Profile-Id
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL_S", "0.001"))
+
+
+def _profile_mode(request: Request):
+    mode = request.query_params.get("profile") or request.headers.get("x-profile")
+    if not mode or mode in ("0", "false"):
+        return None
+    return "html" if mode == "html" else "store"
+
+
+async def profiling_middleware(request: Request, call_next):
+    mode = _profile_mode(request) if PROFILING_ENABLED else None
+    if mode is None:
+        return await call_next(request)
+
+    if PROFILING_TOKEN and request.headers.get("x-profile-token") != PROFILING_TOKEN:
+        return JSONResponse(status_code=403, content={"detail": "Profiling not allowed"})
+
+    # Only imported when a profile is actually requested
+    from pyinstrument import Profiler
+
+    profiler = Profiler(interval=PROFILING_INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+
+    if mode == "html":
+        return HTMLResponse(profiler.output_html())
+
+    try:
+        ensure_capped_collections()
+    except Exception as e:
+        print("Could not create capped collections:", e)
+
+    result = profiles_collection.insert_one({
+        "method": request.method,
+        "path": request.url.path,
+        "duration_ms": round(profiler.last_session.duration * 1000, 2),
+        "profile": profiler.output_text(unicode=True, show_all=False),
+        "created_at": datetime.now(timezone.utc),
+    })
+    response.headers["X-Profile-Id"] = str(result.inserted_id)
+    return response
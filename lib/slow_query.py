@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from bson import json_util
+from models.diagnostics import ensure_capped_collections, slow_queries_collection
+
+# Any aggregate slower than SLOW_QUERY_MS is recorded, together with its
+# explain() plan, in the capped slow_queries collection. Recording happens on a
+# background thread so the slow request isn't made slower still.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+_recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query")
+
+
+def _record(collection, pipeline: list, duration_ms: float, source: str):
+    try:
+        # queryPlanner verbosity plans the pipeline without executing it again
+        explain = collection.database.command(
+            "explain",
+            {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+            verbosity="queryPlanner",
+        )
+    except Exception as e:
+        explain = {"error": str(e)}
+
+    try:
+        ensure_capped_collections()
+        slow_queries_collection.insert_one({
+            "source": source,
+            "collection": collection.name,
+            "duration_ms": round(duration_ms, 2),
+            # Stored as extended JSON: pipelines and plans are full of $-prefixed keys
+            "pipeline": json_util.dumps(pipeline),
+            "explain": json_util.dumps(explain),
+            "created_at": datetime.now(timezone.utc),
+        })
+    except Exception as e:
+        print("Could not record slow query:", e)
+
+
+def run_aggregate(collection, pipeline: list, source: str) -> list:
+    """Runs an aggregate pipeline, logging it to slow_queries when it exceeds SLOW_QUERY_MS"""
+    start = time.perf_counter()
+    result = list(collection.aggregate(pipeline))
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    if duration_ms >= SLOW_QUERY_MS:
+        _recorder.submit(_record, collection, pipeline, duration_ms, source)
+
+    return result
@@ -10,8 +10,19 @@ def generate_short_uuid():
     u = uuid.uuid4().hex  # 32 hex chars
     return f"{u[:4]}-{u[4:8]}-{u[8:12]}"
 
+def hash_file(fileobj, chunk_size: int = 1024 * 1024) -> str:
+    """SHA256 of a file object read in chunks (never fully in memory); rewinds it afterwards"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    while chunk := fileobj.read(chunk_size):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
 FieldType = Literal["numeric", "categorical", "date", "boolean", "unknown"]
 
+BOOL_VALUES = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+
 def detect_column_type(series: pd.Series) -> FieldType:
     """Detects column type similar to frontend version"""
     non_null = series.dropna().astype(str)
@@ -40,6 +51,47 @@ def detect_column_type(series: pd.Series) -> FieldType:
 
     return "categorical"
 
+def detect_stored_type(series: pd.Series) -> FieldType:
+    """
+    Type a column is stored as at ingest. Like detect_column_type, except columns the CSV
+    parser already read as numbers (e.g. a Year column of 2020, 2021, ...) stay numeric
+    rather than being turned into dates.
+    """
+    column_type = detect_column_type(series)
+    if column_type == "date" and not _is_text(series):
+        return "numeric"
+    return column_type
+
+def _is_text(series: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+def coerce_column(series: pd.Series, column_type: FieldType) -> pd.Series:
+    """
+    Converts a column to the native type detect_column_type chose (numbers to ints/doubles,
+    dates to datetimes, booleans to bools). Missing, NaN, inf and unconvertible values become None.
+    """
+    if column_type == "date" and not _is_text(series):
+        # Only text is parsed as dates; numbers stay numbers
+        column_type = "numeric"
+
+    if column_type == "numeric":
+        values = pd.to_numeric(series, errors="coerce").replace([np.inf, -np.inf], np.nan)
+        present = values.notna()
+        if present.any() and (values[present] % 1 == 0).all():
+            values = values.astype("Int64")
+    elif column_type == "date":
+        # Parse the string form, as detection does, so integer years aren't read as epoch nanoseconds
+        values = pd.to_datetime(series.astype("string"), errors="coerce")
+        present = values.notna()
+    elif column_type == "boolean":
+        values = series.astype("string").str.strip().str.lower().map(BOOL_VALUES)
+        present = values.notna()
+    else:
+        values = series
+        present = series.notna()
+
+    return values.astype(object).where(present, None)
+
 # --- Helper Functions for Parquet File Processing ---
 
 def _create_row_hash(row: pd.Series) -> str:
@@ -1,11 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from routers import chart, dataset, dashboard, schema_less, user, parquet
+from routers import chart, dataset, dashboard, schema_less, user, parquet, health
 from lib.ws_manager import manager
+from lib.profiling import profiling_middleware
+from lib.admission import AdmissionMiddleware
+from db.mongo import get_client, close_client
+from models.indexes import ensure_indexes
+from lib.catalog import backfill_catalog, backfill_column_types
 
-app = FastAPI(title="Dataset API", version="1.0")
+
+def prepare_database():
+    # Independent steps: one failing (e.g. another worker winning a create race) doesn't skip the other
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print("Could not ensure indexes:", e)
+    try:
+        backfill_catalog()
+    except Exception as e:
+        print("Could not backfill catalog:", e)
+    try:
+        backfill_column_types()
+    except Exception as e:
+        print("Could not backfill column types:", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creating the client is non-blocking; connections are opened on first use.
+    # Index creation and catalog backfill run off the startup path so an unreachable database can't stall boot.
+    get_client()
+    prepare_task = asyncio.create_task(asyncio.to_thread(prepare_database))
+    yield
+    await prepare_task
+    close_client()
+
+
+app = FastAPI(title="Dataset API", version="1.0", lifespan=lifespan)
 
 # CORS settings
 origins = [
@@ -15,14 +50,21 @@ origins = [
     "http://127.0.0.1:5173",
 ]
 
+# Added before CORS so shed requests (429/503) still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,         
     allow_credentials=True,
     allow_methods=["*"],           
     allow_headers=["*"],          
+    expose_headers=["ETag", "Retry-After"],
 )
 
+# Opt-in request profiling (no-op unless PROFILING_ENABLED=true)
+app.middleware("http")(profiling_middleware)
+
 # include routers
 app.include_router(user.router, prefix="/api")
 app.include_router(dataset.router, prefix="/api")
@@ -30,6 +72,7 @@ app.include_router(chart.router, prefix="/api")
 app.include_router(dashboard.router, prefix="/api")
 app.include_router(schema_less.router, prefix="/api")
 app.include_router(parquet.router, prefix="/api")
+app.include_router(health.router, prefix="/api")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-charts_collection = db["charts"]
+charts_collection = collection("charts")
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-dashboards_collection = db["dashboards"]
+dashboards_collection = collection("dashboards")
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-dataset_collection = db["datasets"]
+dataset_collection = collection("datasets")
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-dataset_metadata_collection = db["dataset_metadata"]
\ No newline at end of file
+dataset_metadata_collection = collection("dataset_metadata")
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import threading
+from pymongo.errors import CollectionInvalid, OperationFailure
+from db.mongo import collection, get_db
+
+# Size caps for the diagnostics collections; the oldest entries roll off
+CAPPED_COLLECTIONS = {
+    "slow_queries": int(os.getenv("SLOW_QUERY_LOG_BYTES", str(64 * 1024 * 1024))),
+    "profiles": int(os.getenv("PROFILE_LOG_BYTES", str(64 * 1024 * 1024))),
+}
+
+# Capped collections, created by ensure_capped_collections
+slow_queries_collection = collection("slow_queries")
+profiles_collection = collection("profiles")
+
+_capped_ready = False
+_capped_lock = threading.Lock()
+
+
+def ensure_capped_collections():
+    """
+    Creates the capped diagnostics collections. Called at startup and before every
+    diagnostics write, so an insert racing startup can't leave an uncapped collection;
+    one that was created uncapped anyway is converted.
+    """
+    global _capped_ready
+    if _capped_ready:
+        return
+    with _capped_lock:
+        if _capped_ready:
+            return
+        db = get_db()
+        for name, size in CAPPED_COLLECTIONS.items():
+            try:
+                db.create_collection(name, capped=True, size=size)
+            except CollectionInvalid:
+                # Already there: another worker created it, or an insert got in first
+                if not db[name].options().get("capped"):
+                    try:
+                        db.command("convertToCapped", name, size=size)
+                    except OperationFailure as e:
+                        print(f"Could not convert {name} to a capped collection:", e)
+        _capped_ready = True
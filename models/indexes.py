@@ -0,0 +1,24 @@
+from pymongo import ASCENDING
+from lib.aggregation import SAMPLE_FIELD
+from models.dataset import dataset_collection
+from models.schema_less import schema_less_collection
+from models.parquet import parquet_collection
+from models.dataset_metadata import dataset_metadata_collection
+from models.diagnostics import ensure_capped_collections
+
+
+def ensure_indexes():
+    """Creates the indexes and capped collections the app relies on (no-op if they already exist)"""
+    for collection in (dataset_collection, schema_less_collection):
+        # Serves upload_id matches and the indexed range read used for sampling
+        collection.create_index([("upload_id", ASCENDING), (SAMPLE_FIELD, ASCENDING)])
+
+    parquet_collection.create_index([("upload_id", ASCENDING)])
+
+    dataset_metadata_collection.create_index([("upload_id", ASCENDING)])
+    # Whole-file fingerprint lookup for CSV re-uploads
+    dataset_metadata_collection.create_index([("file_sha256", ASCENDING), ("source", ASCENDING)])
+    # Upload catalog listing
+    dataset_metadata_collection.create_index([("source", ASCENDING), ("created_at", ASCENDING)])
+
+    ensure_capped_collections()
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-parquet_collection = db["parquet"]
+parquet_collection = collection("parquet")
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-schema_less_collection = db["schema_less"]
+schema_less_collection = collection("schema_less")
@@ -1,3 +1,3 @@
-from db.mongo import db
+from db.mongo import collection
 
-user_collection = db["users"]
+user_collection = collection("users")
@@ -0,0 +1,3 @@
+from db.mongo import collection
+
+versions_collection = collection("versions")
@@ -1,5 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
 from schemas.chart import AggregateRequest, Chart
+from lib.charts import aggregate_datasets, compute_materialized, refresh_charts, stale_chart_ids
+from lib.slow_query import run_aggregate
+from lib.export import aggregate_rows, export_response, infer_schema, iter_batches, validate_export_format
+from lib.etag import CHARTS_KEY, bump_version, check_etag
 from models.dataset import dataset_collection
 from models.chart import charts_collection
 from bson.objectid import ObjectId
@@ -9,50 +13,28 @@ router = APIRouter(prefix="/chart", tags=["Chart"])
 @router.post("/aggregate")
 async def aggregate(request: AggregateRequest):
     """Returns aggregated data based on the provided request parameters"""
+    return aggregate_datasets(request)
 
-    funcs = {"sum": "$sum", "avg": "$avg", "count": "$sum", "min": "$min", "max": "$max"}
-    if request.agg_func not in funcs:
-        raise HTTPException(status_code=400, detail=f"Invalid agg_func. Choose from {list(funcs.keys())}")
-
-    # Match Stage
-    match_stage = {}
-    if request.upload_id:
-        match_stage["upload_id"] = request.upload_id
-
-    if request.year_from or request.year_to:
-        match_stage["year"] = {}
-        if request.year_from:
-            match_stage["year"]["$gte"] = int(request.year_from)
-        if request.year_to:
-            match_stage["year"]["$lte"] = int(request.year_to)
-
-    pipeline = [
-        {"$match": match_stage},
-        {"$group": {
-            "_id": f"${request.x_axis}",
-            request.y_axis: (
-                {"$sum": 1}
-                if request.agg_func == "count"
-                else {funcs[request.agg_func]: f"${request.y_axis}"}
-            )
-        }},
-        {"$project": {request.x_axis: "$_id", request.y_axis: f"${request.y_axis}", "_id": 0}},
-        {"$sort": {request.x_axis: 1}},
-    ]
-
-    result = list(dataset_collection.aggregate(pipeline))
-
-    if not result:
-        raise HTTPException(status_code=404, detail="No records found")
-
-    return result
 
+@router.post("/aggregate/export")
+async def export_aggregate(request: AggregateRequest, format: str = "csv", gzip: bool = False):
+    """Downloads the result of an /aggregate request as CSV or Parquet"""
+    validate_export_format(format)
+    rows, columns = aggregate_rows(aggregate_datasets(request), request.x_axis, request.series_by)
+    return export_response(iter_batches(rows), columns, format, gzip, "aggregate", schema=infer_schema(rows, columns))
 
 
 @router.post("/save")
 async def save_chart(request: Chart):
     """Saves the chart data to the database"""
-    result = charts_collection.insert_one(request.dict())
+    chart = request.dict()
+    # Computed before anything is written, so a chart that can't be computed isn't saved
+    if request.materialize:
+        chart["materialized"] = compute_materialized(chart)
+    try:
+        result = charts_collection.insert_one(chart)
+    finally:
+        bump_version(CHARTS_KEY)
     return {"message": "Chart saved successfully", "chart_id": str(result.inserted_id)}
 
 
@@ -72,10 +54,17 @@ async def update_chart(chart_id: str, request: Chart):
     # Update only provided fields (non-null ones)
     update_data = {k: v for k, v in request.dict().items() if v is not None}
 
-    result = charts_collection.update_one(
-        {"_id": obj_id},
-        {"$set": update_data}
-    )
+    # Any stored result is recomputed from the updated definition before it is written
+    update = {"$set": update_data}
+    if request.materialize:
+        update["$set"]["materialized"] = compute_materialized({**existing_chart, **update_data})
+    else:
+        update["$unset"] = {"materialized": ""}
+
+    try:
+        result = charts_collection.update_one({"_id": obj_id}, update)
+    finally:
+        bump_version(CHARTS_KEY)
 
     if result.modified_count == 0:
         return {"message": "No changes made to chart"}
@@ -84,25 +73,40 @@ async def update_chart(chart_id: str, request: Chart):
 
 
 @router.get("/saved/all")
-async def get_all_saved_charts():
+async def get_all_saved_charts(request: Request, response: Response):
     """Returns all saved charts"""
+    not_modified = check_etag(request, response, CHARTS_KEY)
+    if not_modified:
+        return not_modified
     charts = list(charts_collection.find({"mode": "aggregated"}, {"_id": 1, "name": 1, "chart_type": 1, "x_axis": 1, "y_axis": 1, "agg_func": 1, "year_from": 1, "year_to": 1}))
     for chart in charts:
         chart["_id"] = str(chart["_id"])
     return charts
 
 @router.get("/shared/all")
-async def get_shared_chart_ids():
+async def get_shared_chart_ids(request: Request, response: Response, background_tasks: BackgroundTasks):
     """Returns all chart IDs where shareable=True"""
-    charts = list(charts_collection.find({"shareable": True}, {"_id": 1, "name": 1, "chart_type": 1, "x_axis": 1, "y_axis": 1, "agg_func": 1, "year_from": 1, "year_to": 1}))
+    not_modified = check_etag(request, response, CHARTS_KEY)
+    if not_modified:
+        return not_modified
+    charts = list(charts_collection.find({"shareable": True}, {"_id": 1, "name": 1, "chart_type": 1, "x_axis": 1, "y_axis": 1, "agg_func": 1, "year_from": 1, "year_to": 1, "upload_id": 1, "materialize": 1, "materialized": 1}))
+
+    # Serve stored results as-is; anything stale is recomputed off the request path
+    stale = stale_chart_ids(charts)
+    if stale:
+        background_tasks.add_task(refresh_charts, stale)
+
     for chart in charts:
         chart["_id"] = str(chart["_id"])
     return charts
 
 
 @router.get("/saved/{upload_id}")
-async def get_saved_charts(upload_id: str):
+async def get_saved_charts(upload_id: str, request: Request, response: Response):
     """Returns all saved charts for a given upload_id"""
+    not_modified = check_etag(request, response, CHARTS_KEY)
+    if not_modified:
+        return not_modified
     charts = list(charts_collection.find({"upload_id": upload_id}, {"_id": 1, "name": 1, "chart_type": 1, "x_axis": 1, "y_axis": 1, "agg_func": 1, "year_from": 1, "year_to": 1}))
     for chart in charts:
         chart["_id"] = str(chart["_id"])
@@ -110,17 +114,27 @@ async def get_saved_charts(upload_id: str):
 
 
 @router.get("/saved/chart/{chart_id}")
-async def get_chart(chart_id: str):
+async def get_chart(chart_id: str, request: Request, response: Response, background_tasks: BackgroundTasks):
     """Returns a specific saved chart"""
+    not_modified = check_etag(request, response, CHARTS_KEY)
+    if not_modified:
+        return not_modified
     chart = charts_collection.find_one({"_id": ObjectId(chart_id)})
     if not chart:
         raise HTTPException(status_code=404, detail="Chart not found")
+
+    # Serve the stored result as-is; if it is stale, recompute it off the request path
+    stale = stale_chart_ids([chart])
+    if stale:
+        background_tasks.add_task(refresh_charts, stale)
+
     chart["_id"] = str(chart["_id"])
     return chart
 
 @router.delete("/delete/{chart_id}")
 async def remove_chart(chart_id: str):
     charts_collection.delete_one({"_id": ObjectId(chart_id)})
+    bump_version(CHARTS_KEY)
     return {"message": "Chart deleted successfully"}    
 
 
@@ -144,7 +158,7 @@ async def get_year_range(upload_id: str | None = None):
         {"$project": {"_id": 0, "min_year": 1, "max_year": 1}}
     ]
 
-    result = list(dataset_collection.aggregate(pipeline))
+    result = run_aggregate(dataset_collection, pipeline, "chart.year_range")
 
     if not result or result[0].get("min_year") is None:
         raise HTTPException(status_code=404, detail="No year data found")
@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
 from schemas.dashboard import Dashboard, DashboardUpdate
 from models.dashboard import dashboards_collection
 from models.chart import charts_collection
+from lib.charts import refresh_charts, stale_chart_ids
+from lib.etag import CHARTS_KEY, bump_version, check_etag, dashboard_key
 from bson.objectid import ObjectId
 
 router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
@@ -27,6 +29,7 @@ async def add_to_dashboard(request: Dashboard):
             {"_id": existing["_id"]},
             {"$addToSet": {"charts": request.chart_id}}  
         )
+        bump_version(dashboard_key(request.mode, request.upload_id))
         return {
             "message": "Chart added to existing dashboard successfully",
             "dashboard_id": str(existing["_id"]),
@@ -42,6 +45,7 @@ async def add_to_dashboard(request: Dashboard):
             "year_to": None,
         }
         result = dashboards_collection.insert_one(new_dashboard)
+        bump_version(dashboard_key(request.mode, request.upload_id))
         return {
             "message": "New dashboard created successfully",
             "dashboard_id": str(result.inserted_id),
@@ -52,7 +56,8 @@ async def add_to_dashboard(request: Dashboard):
 # Get a dashboard + populated charts
 # ================================================
 @router.get("/{mode}/{upload_id}")
-async def get_dashboard(mode: str, upload_id: str = None):
+async def get_dashboard(request: Request, response: Response, background_tasks: BackgroundTasks,
+                        mode: str, upload_id: str = None):
     """
     Fetch a dashboard for a given mode and upload_id (which may be null),
     and populate chart details automatically.
@@ -65,6 +70,11 @@ async def get_dashboard(mode: str, upload_id: str = None):
     else:
         query["upload_id"] = upload_id
 
+    # Populated charts are part of the body, so chart edits invalidate it too
+    not_modified = check_etag(request, response, dashboard_key(mode, query["upload_id"]), CHARTS_KEY)
+    if not_modified:
+        return not_modified
+
     dashboard = dashboards_collection.find_one(query)
     if not dashboard:
         return None
@@ -80,6 +90,11 @@ async def get_dashboard(mode: str, upload_id: str = None):
                     "_id": {"$in": [ObjectId(cid) for cid in chart_ids if ObjectId.is_valid(cid)]}
                 })
             )
+            # Materialized charts are served as stored; stale ones refresh in the background
+            stale = stale_chart_ids(chart_objects)
+            if stale:
+                background_tasks.add_task(refresh_charts, stale)
+
             # Convert ObjectId fields to string
             for chart in chart_objects:
                 chart["_id"] = str(chart["_id"])
@@ -115,6 +130,7 @@ async def delete_chart_from_dashboard(dashboard_id: str, chart_id: str):
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Chart not found in dashboard")
 
+    bump_version(dashboard_key(dashboard["mode"], dashboard.get("upload_id")))
     return {"message": f"Chart '{chart_id}' removed from dashboard"}
 
 
@@ -134,13 +150,15 @@ async def update_dashboard_date_range(dashboard_id: str, request: DashboardUpdat
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields to update")
 
-    result = dashboards_collection.update_one(
+    dashboard = dashboards_collection.find_one_and_update(
         {"_id": ObjectId(dashboard_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"mode": 1, "upload_id": 1},
     )
 
-    if result.matched_count == 0:
+    if dashboard is None:
         raise HTTPException(status_code=404, detail="Dashboard not found")
 
+    bump_version(dashboard_key(dashboard["mode"], dashboard.get("upload_id")))
     return {"message": "Dashboard date range updated successfully"}
 
@@ -1,9 +1,16 @@
 from collections import Counter, defaultdict
 import uuid
 import pandas as pd
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from lib.utils import detect_column_type, generate_short_uuid
-from schemas.dataset import Dataset
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException, Request, Response
+from lib.utils import detect_column_type, generate_short_uuid, hash_file
+from lib.aggregation import SAMPLE_FIELD
+from lib.csv_reader import read_csv
+from lib.dataset_ingest import DatasetValidationError, build_dataset_documents, dataset_field_type
+from lib.catalog import column_summary, list_catalog, list_upload_ids
+from lib.charts import refresh_dependent_charts
+from lib.columnar import format_records, negotiate_format
+from lib.export import EXPORT_BATCH_SIZE, dataset_schema, export_response, iter_batches, validate_export_format
+from lib.etag import DATASETS_KEY, bump_version, check_etag, upload_key
 from models.dataset import dataset_collection
 from models.dataset_metadata import dataset_metadata_collection
 from serializers.dataset import all_data
@@ -24,10 +31,28 @@ EXPECTED_COLUMNS = [
 
 # Upload CSV
 @router.post("/upload")
-async def upload_dataset(file: UploadFile = File(...)):
+async def upload_dataset(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """Handles CSV upload and saves dataset + column type metadata"""
     try:
-        df = pd.read_csv(file.file)
+        # An identical file was already ingested: hand back its upload_id before parsing anything
+        file_sha256 = hash_file(file.file)
+        existing = dataset_metadata_collection.find_one(
+            {"file_sha256": file_sha256, "source": "dataset"},
+            {"_id": 0, "upload_id": 1, "column_types": 1},
+        )
+        if existing:
+            return {
+                "message": "This file is an exact duplicate of a previous upload.",
+                "upload_id": existing["upload_id"],
+                "rows_inserted": 0,
+                "column_types": existing.get("column_types", {}),
+                "num_duplicates": 0,
+                "status": "duplicate",
+            }
+
+        # Text fields are read as text, so a model named "3" isn't parsed as a number
+        text_columns = [col for col in EXPECTED_COLUMNS if dataset_field_type(col) is str]
+        df = read_csv(file.file, text_columns=text_columns)
         df.columns = [col.strip().lower() for col in df.columns]
         col_map = {c.lower(): c for c in EXPECTED_COLUMNS}
         df = df[[col for col in df.columns if col in col_map]]
@@ -42,17 +67,12 @@ async def upload_dataset(file: UploadFile = File(...)):
         for col in EXPECTED_COLUMNS:
             if col not in df.columns:
                 df[col] = None
-        df = df[EXPECTED_COLUMNS].where(pd.notnull(df), None)
-
+        df = df[EXPECTED_COLUMNS]
 
         upload_id = generate_short_uuid()
-        records = df.to_dict(orient="records")
-
-        for idx, record in enumerate(records, start=1):
-            record["upload_id"] = upload_id
-            record["row_id"] = idx
+        # Validated and cast column-wise against the Dataset schema
+        valid_records = build_dataset_documents(df, EXPECTED_COLUMNS, upload_id)
 
-        valid_records = [Dataset(**rec).dict() for rec in records]
         if valid_records:
             dataset_collection.insert_many(valid_records)
 
@@ -62,10 +82,20 @@ async def upload_dataset(file: UploadFile = File(...)):
         # Store metadata in a separate collection
         dataset_metadata_collection.insert_one({
             "upload_id": upload_id,
+            "source": "dataset",
+            "file_sha256": file_sha256,
+            "filename": file.filename,
+            "row_count": len(valid_records),
+            "byte_size": file.size,
             "column_types": column_types,
+            "column_summary": column_summary(df, column_types),
             "created_at": pd.Timestamp.now().isoformat()
         })
 
+        bump_version(upload_key(upload_id), DATASETS_KEY)
+        # Cross-upload charts read every dataset upload; refresh their stored results
+        background_tasks.add_task(refresh_dependent_charts, DATASETS_KEY)
+
         # Broadcast to all clients that a new dataset was uploaded
         await manager.broadcast(f"dataset_uploaded:{upload_id}")
 
@@ -77,6 +107,8 @@ async def upload_dataset(file: UploadFile = File(...)):
             "num_duplicates": num_duplicates
         }
 
+    except DatasetValidationError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -85,9 +117,15 @@ async def upload_dataset(file: UploadFile = File(...)):
 # Get all unique upload_ids
 @router.get("/all")
 async def get_all_upload_ids():
-    """Returns all unique upload_id values"""
-    upload_ids = dataset_collection.distinct("upload_id")
-    return {"upload_ids": upload_ids or []}
+    """Returns all upload_id values, oldest first, from the upload catalog"""
+    return {"upload_ids": list_upload_ids("dataset")}
+
+
+# Paginated upload catalog
+@router.get("/catalog")
+async def get_catalog(sort: str = "created_at", order: str = "desc", skip: int = 0, limit: int = 50):
+    """Returns catalog entries (row count, size, created_at, column summary) for dataset uploads"""
+    return list_catalog("dataset", sort, order, skip, limit)
 
 
 # Get all data across all uploads
@@ -101,9 +139,13 @@ async def get_all_data():
 
 
 @router.get("/all/headers")
-async def get_all_headers():
+async def get_all_headers(request: Request, response: Response):
     """Returns all unique headers and merged column types across all uploads"""
-    records = list(dataset_collection.find({}, {"_id": 0}))
+    not_modified = check_etag(request, response, DATASETS_KEY)
+    if not_modified:
+        return not_modified
+
+    records = list(dataset_collection.find({}, {"_id": 0, SAMPLE_FIELD: 0}))
     if not records:
         raise HTTPException(status_code=404, detail="No records found")
 
@@ -118,8 +160,8 @@ async def get_all_headers():
             if value not in (None, "", [], {}):
                 valid_headers.add(key)
 
-    # Fetch all stored metadata
-    metadata_docs = list(dataset_metadata_collection.find({}, {"_id": 0, "column_types": 1}))
+    # Fetch the stored metadata of dataset uploads (the ones DATASETS_KEY versions)
+    metadata_docs = list(dataset_metadata_collection.find({"source": "dataset"}, {"_id": 0, "column_types": 1}))
 
     # Combine column type info across uploads
     type_counts = defaultdict(Counter)
@@ -147,21 +189,42 @@ async def get_all_headers():
 
 # Get all dataset contents
 @router.get("/{upload_id}/data")
-async def get_dataset_contents(upload_id: str):
-    """Returns all records for a specific upload_id"""
+async def get_dataset_contents(upload_id: str, request: Request, format: str | None = None):
+    """Returns all records for a specific upload_id (?format=columnar|arrow for compact encodings)"""
+    response_format = negotiate_format(request, format)
     query = {"upload_id": upload_id}
-    records = list(dataset_collection.find(query, {"_id": 0}))
+    records = list(dataset_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}))
     if not records:
         raise HTTPException(status_code=404, detail="No records found for this upload_id")
-    return all_data(records)
+    if response_format == "rows":
+        return all_data(records)
+    return format_records(records, response_format, columns=["upload_id", "row_id", *EXPECTED_COLUMNS])
+
+
+# Stream an upload as a file
+@router.get("/{upload_id}/export")
+async def export_dataset(upload_id: str, format: str = "csv", gzip: bool = False):
+    """Streams every record of an upload as CSV or Parquet (?gzip=true to compress), batch by batch from the cursor"""
+    validate_export_format(format)
+    query = {"upload_id": upload_id}
+    if not dataset_collection.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="No records found for this upload_id")
+
+    columns = ["upload_id", "row_id", *EXPECTED_COLUMNS]
+    cursor = dataset_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}, batch_size=EXPORT_BATCH_SIZE)
+    return export_response(iter_batches(cursor), columns, format, gzip, upload_id, schema=dataset_schema(columns))
 
 
 # Get all headers per upload
 @router.get("/{upload_id}/headers")
-async def get_headers(upload_id: str):
+async def get_headers(upload_id: str, request: Request, response: Response):
     """Returns headers and column types for a given upload_id"""
+    not_modified = check_etag(request, response, upload_key(upload_id))
+    if not_modified:
+        return not_modified
+
     query = {"upload_id": upload_id}
-    records = list(dataset_collection.find(query, {"_id": 0}))
+    records = list(dataset_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}))
 
     if not records:
         raise HTTPException(status_code=404, detail="No records found")
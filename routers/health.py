@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from db.mongo import ping, pool_stats
+from lib.admission import controller
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@router.get("/live")
+def liveness():
+    """The process is up; never touches the database"""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def readiness():
+    """Pings MongoDB and reports connection pool health; 503 until the database is reachable"""
+    try:
+        latency_ms = ping()
+    except Exception as e:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unavailable", "detail": str(e), "pool": pool_stats.snapshot()},
+        )
+
+    return {"status": "ready", "ping_ms": round(latency_ms, 2), "pool": pool_stats.snapshot()}
+
+
+@router.get("/admission")
+def admission():
+    """Concurrency limits, in-flight and queued requests, and shed counts per endpoint class"""
+    return controller.snapshot()
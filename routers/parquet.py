@@ -1,9 +1,15 @@
 import pandas as pd
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from lib.utils import generate_short_uuid, _create_row_hash, _get_columns_from_schema
+from lib.charts import aggregate_parquet
+from lib.columnar import format_records, negotiate_format
+from lib.export import (
+    EXPORT_BATCH_SIZE, aggregate_rows, collection_schema, export_response, infer_schema, iter_batches,
+    validate_export_format
+)
 from models.parquet import parquet_collection
 
-from schemas.parquet import ChartDataRequest
+from schemas.parquet import ChartDataRequest, ParquetAggregateRequest
 
 router = APIRouter(prefix="/parquet", tags=["Parquet"])
 
@@ -113,10 +119,12 @@ async def upload_parquet(file: UploadFile = File(...)):
 
 
 @router.post("/chart-data")
-async def fetch_chart_data(request: ChartDataRequest):
+async def fetch_chart_data(request: ChartDataRequest, http_request: Request, format: str | None = None):
     """
     Fetches specific chart data from the parquet collection for a given upload_id.
+    Pass ?format=columnar|arrow (or the matching Accept header) for compact encodings.
     """
+    response_format = negotiate_format(http_request, format)
     try:
         print(f"[DEBUG] Entered fetch_chart_data function for upload_id: {request.upload_id}")
         query = {"upload_id": request.upload_id}
@@ -137,8 +145,43 @@ async def fetch_chart_data(request: ChartDataRequest):
         
         print(f"[DEBUG] Found {len(records)} records.")
 
-        return records
+        return format_records(records, response_format)
 
     except Exception as e:
         print(f"[DEBUG] An exception occurred in fetch_chart_data: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while fetching chart data.")
+
+
+@router.post("/aggregate")
+async def parquet_aggregate(request: ParquetAggregateRequest):
+    """
+    Groups a parquet upload on the server (optionally bucketing a date x_axis by time_grain)
+    and returns only the aggregated result.
+    """
+    return aggregate_parquet(request)
+
+
+@router.post("/aggregate/export")
+async def export_parquet_aggregate(request: ParquetAggregateRequest, format: str = "csv", gzip: bool = False):
+    """Downloads the result of a /parquet/aggregate request as CSV or Parquet"""
+    validate_export_format(format)
+    rows, columns = aggregate_rows(aggregate_parquet(request), request.x_axis, request.series_by)
+    return export_response(
+        iter_batches(rows), columns, format, gzip, f"{request.upload_id}-aggregate", schema=infer_schema(rows, columns)
+    )
+
+
+@router.get("/{upload_id}/export")
+async def export_parquet_upload(upload_id: str, format: str = "csv", gzip: bool = False):
+    """Streams every row of a parquet upload as CSV or Parquet, batch by batch from the cursor"""
+    validate_export_format(format)
+    query = {"upload_id": upload_id}
+    first_doc = parquet_collection.find_one(query, {"_id": 0, "_hash": 0})
+    if not first_doc:
+        raise HTTPException(status_code=404, detail="No records found for this upload_id")
+
+    columns = ["upload_id", *_get_columns_from_schema(first_doc)]
+    # Parquet uploads keep no column types, so read them off the stored values (Parquet only)
+    schema = collection_schema(parquet_collection, query, columns, "parquet.export") if format == "parquet" else None
+    cursor = parquet_collection.find(query, {"_id": 0, "_hash": 0}, batch_size=EXPORT_BATCH_SIZE)
+    return export_response(iter_batches(cursor), columns, format, gzip, upload_id, schema=schema)
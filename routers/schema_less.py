@@ -1,8 +1,17 @@
 import pandas as pd
 import numpy as np
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from pymongo import ASCENDING
-from lib.utils import detect_column_type, generate_short_uuid
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
+from lib.utils import coerce_column, detect_stored_type, generate_short_uuid, hash_file
+from lib.aggregation import SAMPLE_FIELD
+from lib.csv_reader import read_csv
+from lib.catalog import column_summary, list_catalog, list_upload_ids
+from lib.charts import aggregate_schemaless
+from lib.columnar import format_records, negotiate_format
+from lib.export import (
+    EXPORT_BATCH_SIZE, aggregate_rows, arrow_schema, export_response, infer_schema, iter_batches, stored_types,
+    validate_export_format
+)
+from lib.etag import bump_version, check_etag, upload_key
 from models.schema_less import schema_less_collection
 from schemas.schema_less import SchemalessAggregateRequest
 from models.dataset_metadata import dataset_metadata_collection
@@ -13,49 +22,58 @@ router = APIRouter(prefix="/schemaless", tags=["Schema Less"])
 @router.post("/upload")
 async def upload_dataset(file: UploadFile = File(...)):
     try:
-        df = pd.read_csv(file.file)
+        # An identical file was already ingested: hand back its upload_id before parsing anything
+        file_sha256 = hash_file(file.file)
+        existing = dataset_metadata_collection.find_one(
+            {"file_sha256": file_sha256, "source": "schemaless"},
+            {"_id": 0, "upload_id": 1, "column_types": 1},
+        )
+        if existing:
+            return {
+                "message": "This file is an exact duplicate of a previous upload.",
+                "upload_id": existing["upload_id"],
+                "column_types": existing.get("column_types", {}),
+                "status": "duplicate",
+            }
+
+        df = read_csv(file.file)
         df.columns = [col.strip().lower() for col in df.columns]
 
-        # df = df.apply(pd.to_numeric, errors='ignore')
-
-        # df = df.replace([np.inf, -np.inf], np.nan)
-
-        # df = df.replace({pd.NA: None, np.nan: None})
+        # Detect column types, then store each column as that type so
+        # aggregations run on native numbers/dates instead of strings and NaN
+        column_types = {col: detect_stored_type(df[col]) for col in df.columns}
+        for col, column_type in column_types.items():
+            df[col] = coerce_column(df[col], column_type)
 
         upload_id = f"{generate_short_uuid()}"
         records = df.to_dict(orient="records")
 
+        # Random key per row so approximate aggregates can read a uniform sample by index
+        sample_keys = np.random.random(len(records))
+
         for idx, record in enumerate(records, start=1):
             record["upload_id"] = upload_id
             record["row_id"] = idx
-
-        # def is_convertible_to_number(value:str):
-        #     try:
-        #         float(value)
-        #         return True
-        #     except ValueError:
-        #         return False
-            
-
-        # for record in records:
-        #     for key, value in record.items():
-        #         if value and is_convertible_to_number(value):
-        #             record[key] = float(value)
-        #         elif value == None:
-        #             record[key] = ""
+            record[SAMPLE_FIELD] = float(sample_keys[idx - 1])
 
         schema_less_collection.insert_many(records)
 
-        # Detect column types
-        column_types = {col: detect_column_type(df[col]) for col in df.columns}
-
         # Store metadata in a separate collection
         dataset_metadata_collection.insert_one({
             "upload_id": upload_id,
+            "source": "schemaless",
+            "file_sha256": file_sha256,
+            "filename": file.filename,
+            "row_count": len(records),
+            "byte_size": file.size,
             "column_types": column_types,
+            "column_summary": column_summary(df, column_types),
+            "types_checked": True,  # detect_stored_type already keeps numeric columns numeric
             "created_at": pd.Timestamp.now().isoformat()
         })
 
+        bump_version(upload_key(upload_id))
+
         return {
             "message": "CSV uploaded successfully",
             "upload_id": upload_id,
@@ -67,17 +85,41 @@ async def upload_dataset(file: UploadFile = File(...)):
     
 
 @router.get("/{upload_id}/data")
-async def get_dataset_contents(upload_id: str):
+async def get_dataset_contents(upload_id: str, request: Request, format: str | None = None):
+    response_format = negotiate_format(request, format)
     query = {"upload_id": upload_id}
-    records = list(schema_less_collection.find(query, {"_id": 0}))
+    records = list(schema_less_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}))
     if not records:
         raise HTTPException(status_code=404, detail="No records found for this upload_id")
-    return records
+    return format_records(records, response_format)
+
+@router.get("/{upload_id}/export")
+async def export_dataset(upload_id: str, format: str = "csv", gzip: bool = False):
+    """Streams every record of an upload as CSV or Parquet (?gzip=true to compress), batch by batch from the cursor"""
+    validate_export_format(format)
+    metadata = dataset_metadata_collection.find_one({"upload_id": upload_id}, {"_id": 0, "column_types": 1})
+    query = {"upload_id": upload_id}
+    if not metadata or not schema_less_collection.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="No records found for this upload_id")
+
+    # Columns in upload order, as recorded at ingest
+    columns = ["upload_id", "row_id", *metadata["column_types"].keys()]
+    schema = None
+    if format == "parquet":
+        # Checked against the stored values up front, so a stale recorded type can't fail mid-stream
+        stored = stored_types(schema_less_collection, query, columns, "schemaless.export")
+        schema = arrow_schema(columns, metadata["column_types"], stored)
+    cursor = schema_less_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}, batch_size=EXPORT_BATCH_SIZE)
+    return export_response(iter_batches(cursor), columns, format, gzip, upload_id, schema=schema)
 
 @router.get("/{upload_id}/headers")
-async def get_headers(upload_id: str):
+async def get_headers(upload_id: str, request: Request, response: Response):
+    not_modified = check_etag(request, response, upload_key(upload_id))
+    if not_modified:
+        return not_modified
+
     query = {"upload_id": upload_id}
-    records = list(schema_less_collection.find(query, {"_id": 0}))
+    records = list(schema_less_collection.find(query, {"_id": 0, SAMPLE_FIELD: 0}))
 
     if not records:
         raise HTTPException(status_code=404, detail="No records found")
@@ -102,9 +144,15 @@ async def get_headers(upload_id: str):
 # Get all unique upload_ids
 @router.get("/all")
 async def get_all_upload_ids():
-    """Returns all unique upload_id values"""
-    upload_ids = schema_less_collection.distinct("upload_id")
-    return {"upload_ids": upload_ids or []}
+    """Returns all upload_id values, oldest first, from the upload catalog"""
+    return {"upload_ids": list_upload_ids("schemaless")}
+
+
+# Paginated upload catalog
+@router.get("/catalog")
+async def get_catalog(sort: str = "created_at", order: str = "desc", skip: int = 0, limit: int = 50):
+    """Returns catalog entries (row count, size, created_at, column summary) for schemaless uploads"""
+    return list_catalog("schemaless", sort, order, skip, limit)
 
 
 @router.post("/aggregate")
@@ -112,38 +160,14 @@ async def schemaless_aggregate(request: SchemalessAggregateRequest):
     """
     Aggregates schemaless dataset fields dynamically based on user-selected x/y axes.
     """
-    upload_id = request.upload_id
-    x_axis = request.x_axis
-    y_axis = request.y_axis
-    agg_func = request.agg_func
-
-
-    funcs = {"sum": "$sum", "avg": "$avg", "count": "$sum", "min": "$min", "max": "$max"}
-    if agg_func not in funcs:
-        raise HTTPException(status_code=400, detail=f"Invalid agg_func. Choose from {list(funcs.keys())}")
-
-    match_stage = {"upload_id": upload_id}
-
-
-    pipeline = [
-        {"$match": match_stage},
-        {"$group": {
-            "_id": f"${x_axis}",
-            y_axis: (
-                {"$sum": 1}
-                if agg_func == "count"
-                else {funcs[agg_func]: f"${y_axis}"}
-            ),
-        }},
-        {"$project": {x_axis: "$_id", y_axis: f"${y_axis}", "_id": 0}},
-        {"$sort": {x_axis: ASCENDING}},
-    ]
-
-    # --- Execute and return ---
-    try:
-        result = list(schema_less_collection.aggregate(pipeline))
-        if not result:
-            raise HTTPException(status_code=404, detail="No matching data found for aggregation")
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    return aggregate_schemaless(request)
+
+
+@router.post("/aggregate/export")
+async def export_schemaless_aggregate(request: SchemalessAggregateRequest, format: str = "csv", gzip: bool = False):
+    """Downloads the result of a /schemaless/aggregate request as CSV or Parquet"""
+    validate_export_format(format)
+    rows, columns = aggregate_rows(aggregate_schemaless(request), request.x_axis, request.series_by)
+    return export_response(
+        iter_batches(rows), columns, format, gzip, f"{request.upload_id}-aggregate", schema=infer_schema(rows, columns)
+    )
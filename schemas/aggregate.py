@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class Measure(BaseModel):
+    y_axis: Optional[str] = None  # not needed for count
+    agg_func: str = "sum"
+    alias: Optional[str] = None  # key in the response, defaults to "<y_axis>_<agg_func>"
@@ -1,13 +1,26 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from schemas.filter import FilterExpr
+from schemas.aggregate import Measure
 
 class AggregateRequest(BaseModel):
     upload_id: Optional[str] = None
     x_axis: str
-    y_axis: str
+    y_axis: Optional[str] = None
     agg_func: str = "sum"
     year_from: Optional[int] = None
     year_to: Optional[int] = None
+    filters: Optional[FilterExpr] = None
+    measures: Optional[List[Measure]] = None  # several y_axis/agg_func pairs computed in one pass
+    series_by: Optional[str] = None  # second group-by dimension for stacked series
+    approximate: bool = False  # estimate from a uniform sample instead of a full scan
+    sample_size: int = Field(10000, gt=0)
+    time_grain: Optional[str] = None  # hour/day/week/month/quarter/year bucketing of a date x_axis
+    timezone: Optional[str] = None  # e.g. "Asia/Manila", defaults to UTC
+    fill_gaps: bool = False  # add empty buckets between the first and last time bucket
+    top_n: Optional[int] = None  # keep the top N x values, folding the rest into an "(other)" group
+    order_by: Optional[str] = None  # "key" or "value" (first measure); defaults to value when top_n is set
+    order: Optional[str] = None  # "asc" or "desc"; defaults to desc for value, asc for key
 
 
 class Chart(BaseModel):
@@ -22,3 +35,13 @@ class Chart(BaseModel):
     name: Optional[str] = None
     chart_library: str
     shareable: Optional[bool] = False
+    filters: Optional[FilterExpr] = None
+    measures: Optional[List[Measure]] = None
+    series_by: Optional[str] = None
+    time_grain: Optional[str] = None
+    timezone: Optional[str] = None
+    fill_gaps: Optional[bool] = False
+    top_n: Optional[int] = None
+    order_by: Optional[str] = None
+    order: Optional[str] = None
+    materialize: Optional[bool] = False  # store computed series with the chart and serve them on view
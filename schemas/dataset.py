@@ -12,3 +12,15 @@ class Dataset(BaseModel):
     mileage_km: Optional[float] = None
     price_usd: Optional[float] = None
     sales_volume: Optional[int] = None
+
+# Stored types of the fixed dataset schema, used to validate filters
+DATASET_COLUMN_TYPES = {
+    "model": "categorical",
+    "year": "numeric",
+    "region": "categorical",
+    "color": "categorical",
+    "transmission": "categorical",
+    "mileage_km": "numeric",
+    "price_usd": "numeric",
+    "sales_volume": "numeric",
+}
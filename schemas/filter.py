@@ -0,0 +1,26 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Any, List, Literal, Optional, Union
+
+FilterOp = Literal[
+    "eq", "ne", "in", "nin", "gt", "gte", "lt", "lte", "between", "is_null", "not_null"
+]
+
+
+class FilterCondition(BaseModel):
+    """A single column predicate, e.g. {"column": "region", "op": "in", "value": ["Asia", "Europe"]}"""
+    model_config = ConfigDict(extra="forbid")
+
+    column: str
+    op: FilterOp = "eq"
+    value: Optional[Any] = None  # list for in/nin, [low, high] for between, unused for null checks
+
+
+class FilterExpr(BaseModel):
+    """A group of conditions (or nested groups) combined with and/or"""
+    model_config = ConfigDict(extra="forbid")
+
+    logic: Literal["and", "or"] = "and"
+    conditions: List[Union[FilterCondition, "FilterExpr"]] = []
+
+
+FilterExpr.model_rebuild()
@@ -1,4 +1,17 @@
 from pydantic import BaseModel
+from typing import List, Optional
+from schemas.aggregate import Measure
 
 class ChartDataRequest(BaseModel):
-    upload_id: str
\ No newline at end of file
+    upload_id: str
+
+class ParquetAggregateRequest(BaseModel):
+    upload_id: str
+    x_axis: str
+    y_axis: Optional[str] = None
+    agg_func: str = "sum"
+    measures: Optional[List[Measure]] = None  # several y_axis/agg_func pairs computed in one pass
+    series_by: Optional[str] = None  # second group-by dimension for stacked series
+    time_grain: Optional[str] = None  # hour/day/week/month/quarter/year bucketing of a date x_axis
+    timezone: Optional[str] = None  # e.g. "Asia/Manila", defaults to UTC
+    fill_gaps: bool = False  # add empty buckets between the first and last time bucket
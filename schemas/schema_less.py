@@ -1,8 +1,22 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from schemas.filter import FilterExpr
+from schemas.aggregate import Measure
 
 class SchemalessAggregateRequest(BaseModel):
     upload_id: str
     x_axis: str
-    y_axis: str
+    y_axis: Optional[str] = None
     agg_func: str = "sum"
     buckets: int = 20
+    filters: Optional[FilterExpr] = None
+    measures: Optional[List[Measure]] = None  # several y_axis/agg_func pairs computed in one pass
+    series_by: Optional[str] = None  # second group-by dimension for stacked series
+    approximate: bool = False  # estimate from a uniform sample instead of a full scan
+    sample_size: int = Field(10000, gt=0)
+    time_grain: Optional[str] = None  # hour/day/week/month/quarter/year bucketing of a date x_axis
+    timezone: Optional[str] = None  # e.g. "Asia/Manila", defaults to UTC
+    fill_gaps: bool = False  # add empty buckets between the first and last time bucket
+    top_n: Optional[int] = None  # keep the top N x values, folding the rest into an "(other)" group
+    order_by: Optional[str] = None  # "key" or "value" (first measure); defaults to value when top_n is set
+    order: Optional[str] = None  # "asc" or "desc"; defaults to desc for value, asc for key